@@ -0,0 +1,27 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from wagtail.models import get_page_models
+from wagtail.signals import page_published, page_unpublished
+from explore.cache import bump_data_version, bump_on_commit
+from .models import FooterSettings
+
+
+def bump_cms_version():
+    bump_data_version("cms")
+
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def page_changed(sender, **kwargs):
+    bump_on_commit(bump_cms_version)
+
+
+def content_changed(sender, **kwargs):
+    bump_on_commit(bump_cms_version)
+
+
+# per sender, a post_delete receiver for any sender turns off fast deletes
+post_save.connect(content_changed, sender=FooterSettings)
+post_delete.connect(content_changed, sender=FooterSettings)
+for page_model in get_page_models():
+    post_delete.connect(content_changed, sender=page_model)
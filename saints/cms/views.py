@@ -2,6 +2,7 @@ from rest_framework.generics import RetrieveAPIView
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from wagtail.models import Site
+from explore.cache import conditional_response
 
 from .models import ContentPage, FooterSettings
 from .serializers import ContentPageSerializer, FooterSettingsSerializer
@@ -14,6 +15,9 @@ class ContentPageDetailView(RetrieveAPIView):
     def get_queryset(self):
         return ContentPage.objects.live().public()
 
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(super().retrieve, request, *args, scope="cms", **kwargs)
+
 
 class FooterSettingsView(APIView):
     serializer_class = FooterSettingsSerializer
@@ -22,6 +26,9 @@ class FooterSettingsView(APIView):
         return FooterSettings.objects.all()
 
     def get(self, request):
+        return conditional_response(self.get_footer, request, scope="cms")
+
+    def get_footer(self, request):
         site = Site.find_for_request(request)
         footer = FooterSettings.for_site(site)
         serializer = FooterSettingsSerializer(footer)
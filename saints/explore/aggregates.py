@@ -0,0 +1,64 @@
+from django.db.models import Count, Q
+from .models import MapSummary, year_range
+
+
+# Page-level aggregations for the map layers. Each function takes the ids of
+# the places on a page and returns a {place_id: {key: count}} lookup that is
+# computed from the map summary with a single query instead of one query per
+# place.
+def cult_type_counts(place_ids, types=None, years=None):
+    """ Count the cults of each place by cult type. If types are given,
+    cults are counted for every requested type they belong to on any level
+    of the cult type hierarchy.
+    """
+    queryset = MapSummary.objects.filter(place_id__in=place_ids, own=True)
+    if years is not None:
+        queryset = queryset.filter(years__overlap=year_range(*years))
+    if types:
+        counts = {place_id: {type: 0 for type in types} for place_id in place_ids}
+        queryset = queryset.filter(cult_types__overlap=types)
+        annotations = {
+            "type_%d" % i: Count("id", filter=Q(cult_types__contains=[type]))
+            for i, type in enumerate(types)
+        }
+        for row in queryset.values("place_id").annotate(**annotations).order_by():
+            for i, type in enumerate(types):
+                counts[row["place_id"]][type] = row["type_%d" % i]
+    else:
+        counts = {place_id: {} for place_id in place_ids}
+        for row in queryset.values("place_id", "cult_type").annotate(count=Count("id")).order_by():
+            counts[row["place_id"]][row["cult_type"]] = row["count"]
+    return counts
+
+
+def agent_counts(relation, place_ids, types=None, agents=None):
+    """ Count the agents related to the cults of each place, "saint" for
+    RelationCultAgent and "people" for RelationOtherAgent. Counts are keyed
+    by agent type unless agents are given.
+    """
+    field = "%s_types" % relation
+    keys = types
+    if types is None and agents is not None:
+        field = "%s_ids" % relation
+        keys = agents
+    if keys is not None:
+        keys = {int(key) for key in keys}
+    counts = {place_id: {} for place_id in place_ids}
+    rows = MapSummary.objects.filter(place_id__in=place_ids, own=True).values_list("place_id", field)
+    for place_id, values in rows:
+        for value in values:
+            if keys is None or value in keys:
+                counts[place_id][value] = counts[place_id].get(value, 0) + 1
+    return counts
+
+
+def place_cult_type_counts(place_ids, cults):
+    """ Count the cults of the given queryset by cult type for each place,
+    where a cult belongs both to its own place and to the places related
+    through RelationOtherPlace
+    """
+    queryset = MapSummary.objects.filter(place_id__in=place_ids, cult__in=cults.values("id"))
+    counts = {place_id: {} for place_id in place_ids}
+    for row in queryset.values("place_id", "cult_type").annotate(count=Count("id")).order_by():
+        counts[row["place_id"]][row["cult_type"]] = row["count"]
+    return counts
@@ -0,0 +1,130 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import require_safe
+from rest_framework.request import Request
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from . import samsoek
+from .cache import get_cache_key
+from .models import Cult
+from .renderers import ORJSONRenderer
+from .serializers import CultSerializer
+from .views import AgentsViewSet, CultsViewSet, MapViewSet, PeopleViewSet, \
+    PlacesViewSet, SaintsViewSet
+
+# Async versions of the map, cult detail and search endpoints for deployments
+# under an ASGI server. They build their querysets and serializers with the
+# viewsets of the sync endpoints, run the queries through the async ORM and
+# fetch K-samsök records without blocking, so that a worker can keep many
+# slow requests in flight. Lists are paginated by page number only.
+SEARCH_VIEWSETS = {
+    "saints": SaintsViewSet,
+    "people": PeopleViewSet,
+    "agents": AgentsViewSet,
+    "cult": CultsViewSet,
+    "place": PlacesViewSet,
+}
+
+
+def get_view(viewset, request, action, **kwargs):
+    return viewset(request=Request(request), action=action, detail=action == "retrieve",
+                   kwargs=kwargs, format_kwarg=None)
+
+
+def not_found():
+    return JsonResponse({"detail": "Not found."}, status=404)
+
+
+def render(data):
+    return HttpResponse(ORJSONRenderer().render(data), content_type="application/json")
+
+
+async def cached_response(view, get_data):
+    """ Serve the data of a view from the response cache, or store the data
+    returned by the `get_data` coroutine in it
+    """
+    key = await sync_to_async(get_cache_key)(view.request)
+    data = await cache.aget(key)
+    if data is None:
+        try:
+            data = await get_data()
+        except Http404:
+            return not_found()
+        if not getattr(view.request, "skip_response_cache", False):
+            await cache.aset(key, data, settings.EXPLORE_CACHE_TIMEOUT)
+    return render(data)
+
+
+def get_queryset(view):
+    # some filters look up rows while building the queryset
+    return view.filter_queryset(view.get_queryset())
+
+
+def get_page_number(view, paginator, count, page_size):
+    number = view.request.query_params.get(paginator.page_query_param, "1")
+    if not number.isdigit() or int(number) < 1 or (int(number) - 1) * page_size >= max(count, 1):
+        raise Http404
+    return int(number)
+
+
+def get_page_link(view, paginator, number):
+    url = view.request.build_absolute_uri()
+    if number == 1:
+        return remove_query_param(url, paginator.page_query_param)
+    return replace_query_param(url, paginator.page_query_param, number)
+
+
+async def get_page(view):
+    """ Return a page of the filtered queryset of a view like its page number
+    pagination would
+    """
+    queryset = await sync_to_async(get_queryset)(view)
+    paginator = view.pagination_class()
+    page_size = paginator.get_page_size(view.request)
+    count = await queryset.acount()
+    number = get_page_number(view, paginator, count, page_size)
+    objects = [obj async for obj in queryset[(number - 1) * page_size:number * page_size]]
+    serializer = view.get_serializer(objects, many=True)
+    # the serializers of the map look up their counts in the database
+    results = await sync_to_async(lambda: serializer.data)()
+    return {
+        "count": count,
+        "next": get_page_link(view, paginator, number + 1) if number * page_size < count else None,
+        "previous": get_page_link(view, paginator, number - 1) if number > 1 else None,
+        "results": results,
+    }
+
+
+@require_safe
+async def map_list(request):
+    view = get_view(MapViewSet, request, "list")
+    return await cached_response(view, lambda: get_page(view))
+
+
+@require_safe
+async def search(request, basename):
+    if basename not in SEARCH_VIEWSETS:
+        return not_found()
+    view = get_view(SEARCH_VIEWSETS[basename], request, "list")
+    return await cached_response(view, lambda: get_page(view))
+
+
+async def get_cult(view, pk):
+    try:
+        cult = await (await sync_to_async(get_queryset)(view)).aget(pk=pk)
+    except Cult.DoesNotExist:
+        raise Http404
+    context = view.get_serializer_context()
+    if view.get_serializer_class() is CultSerializer:
+        # prefetched by the viewset
+        uris = [resource.resource_uri for resource in cult.relationmbresource_set.all()]
+        context["samsoek"] = await samsoek.aget_resources(uris)
+    serializer = view.get_serializer_class()(cult, context=context)
+    return await sync_to_async(lambda: serializer.data)()
+
+
+@require_safe
+async def cult_detail(request, pk):
+    view = get_view(CultsViewSet, request, "retrieve", pk=pk)
+    return await cached_response(view, lambda: get_cult(view, pk))
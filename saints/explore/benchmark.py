@@ -0,0 +1,144 @@
+import math
+import time
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from .renderers import ORJSONRenderer
+from .urls import router
+from .views import KeysetPaginationMixin
+
+# Scripted requests against every endpoint of the explore API, for datasets
+# made by synthetic.generate. Ids refer to rows every scale contains.
+BBOX = "12.0,57.0,18.0,62.0"
+RANGE = "1100,1300"
+MAP_REQUESTS = [
+    ("place", {}),
+    ("place", {"zoom": "8"}),
+    ("place", {"zoom": "12", "bbox": BBOX}),
+    ("place", {"ids": "1,2"}),
+    ("cult", {}),
+    ("cult", {"ids": "1,5"}),
+    ("cult", {"ids": "1,5", "range": RANGE}),
+    ("cult", {"range": RANGE, "bbox": BBOX}),
+    ("saints", {}),
+    ("saints", {"ids": "1,2"}),
+    ("saints", {"agent": "1,2", "range": RANGE}),
+    ("people", {"ids": "1,2", "bbox": BBOX}),
+    ("place", {"format": "columns"}),
+    ("cult", {"format": "columns"}),
+    ("saints", {"format": "columns"}),
+]
+ADVANCED_MAP_REQUESTS = [
+    {},
+    {"type": "1,5"},
+    {"type": "17", "range": RANGE},
+    {"agent_type": "1,2", "bbox": BBOX},
+    {"agent": "1,2", "place_type": "1"},
+    {"format": "columns"},
+]
+# every third agent is not a saint, place 2 is a child of place 1
+DETAIL_IDS = {"people": 3, "placechildren": 2}
+LIST_PARAMS = {"placechildren": {"id": "1"}}
+# endpoints with a `mini` variant
+MINI = ["saints", "people", "agents", "cult", "place", "source", "quote"]
+# renderers compared on the map and detail responses
+RENDERERS = [JSONRenderer, ORJSONRenderer]
+
+
+def get_requests():
+    """ Return (name, path, params) of the requests to run
+    """
+    requests = []
+    for prefix, viewset, basename in router.registry:
+        path = "/api/%s/" % prefix
+        if basename == "metrics":
+            continue
+        if basename == "map":
+            for layer, params in MAP_REQUESTS:
+                params = dict(params, layer=layer)
+                name = "map " + " ".join("%s=%s" % item for item in sorted(params.items()))
+                requests.append((name, path, params))
+                if layer in ("place", "cult"):
+                    params = dict(params, zoom=params.get("zoom", "6"))
+                    name = "map clusters " + " ".join("%s=%s" % item for item in sorted(params.items()))
+                    requests.append((name, path + "clusters/", params))
+            continue
+        if basename == "advancedmap":
+            for params in ADVANCED_MAP_REQUESTS:
+                name = " ".join(["advancedmap"] + ["%s=%s" % item for item in sorted(params.items())])
+                requests.append((name, path, params))
+            continue
+        params = LIST_PARAMS.get(basename, {})
+        requests.append(("%s list" % basename, path, params))
+        if basename == "export":
+            requests.append(("export ndjson", path, {"output": "ndjson"}))
+            continue
+        if basename in MINI:
+            requests.append(("%s list mini" % basename, path, dict(params, mini="true")))
+        if issubclass(viewset, KeysetPaginationMixin):
+            requests.append(("%s list cursor" % basename, path, dict(params, pagination="cursor")))
+        detail = "%s%d/" % (path, DETAIL_IDS.get(basename, 1))
+        requests.append(("%s detail" % basename, detail, {}))
+        if basename in MINI:
+            requests.append(("%s detail mini" % basename, detail, {"mini": "true"}))
+    return requests
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[max(math.ceil(share * len(values)) - 1, 0)]
+
+
+def measure(client, path, params, repeat):
+    durations = []
+    for i in range(repeat):
+        # measure the work of the view, not the response cache
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(path, params)
+            content = b"".join(response.streaming_content) if response.streaming else response.content
+            durations.append(time.perf_counter() - start)
+    return {
+        "status": response.status_code,
+        "queries": len(queries.captured_queries),
+        "p50_ms": round(percentile(durations, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(durations, 0.95) * 1000, 2),
+        "size": len(content),
+    }
+
+
+def measure_renderers(client, path, params, repeat):
+    """ Time rendering the data of a response with each of RENDERERS
+    """
+    data = getattr(client.get(path, params), "data", None)
+    if data is None:
+        return None
+    results = {}
+    for renderer_class in RENDERERS:
+        renderer = renderer_class()
+        durations = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            content = renderer.render(data, "application/json", {})
+            durations.append(time.perf_counter() - start)
+        results[renderer.format] = {
+            "p50_ms": round(percentile(durations, 0.5) * 1000, 2),
+            "p95_ms": round(percentile(durations, 0.95) * 1000, 2),
+            "size": len(content),
+        }
+    return results
+
+
+def run(repeat=5, requests=None, renderers=False):
+    client = Client()
+    results = []
+    for name, path, params in requests or get_requests():
+        result = {"name": name, "path": path, "params": params}
+        result.update(measure(client, path, params, repeat))
+        if renderers and (name.startswith("map") or name.startswith("advancedmap") or name.endswith(" detail")):
+            result["renderers"] = measure_renderers(client, path, params, repeat)
+        results.append(result)
+    return results
@@ -0,0 +1,103 @@
+import hashlib
+import time
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, urlencode
+from rest_framework.response import Response
+
+VERSION_KEY = "%s:version"
+
+
+def get_data_state(scope="explore"):
+    """ Return the token identifying the current state of the data of the
+    given scope together with the time it was last changed
+    """
+    state = cache.get(VERSION_KEY % scope)
+    if state is None:
+        new_state = {"version": uuid4().hex, "modified": time.time()}
+        cache.add(VERSION_KEY % scope, new_state, timeout=None)
+        # another process may have added its state first, and a dummy cache
+        # or an eviction leaves none at all
+        state = cache.get(VERSION_KEY % scope) or new_state
+    return state
+
+
+def get_data_version(scope="explore"):
+    return get_data_state(scope)["version"]
+
+
+def bump_data_version(scope="explore"):
+    # a fresh random token instead of a counter, so that entries can't be
+    # served again if the version itself was evicted from the cache
+    cache.set(VERSION_KEY % scope, {"version": uuid4().hex, "modified": time.time()}, timeout=None)
+
+
+def bump_on_commit(func):
+    """ Call `func` once the current transaction is committed, unless the
+    transaction already has it queued, so that a save with many related
+    rows changes the version once
+    """
+    connection = transaction.get_connection()
+    if not any(queued is func for savepoints, queued, robust in connection.run_on_commit):
+        transaction.on_commit(func)
+
+
+def get_request_url(request):
+    params = sorted((key, value) for key, values in request.query_params.lists() for value in values)
+    return request.path + "?" + urlencode(params)
+
+
+def get_cache_key(request, version=None):
+    if version is None:
+        version = get_data_version()
+    return "explore:response:%s:%s" % (version, hashlib.md5(get_request_url(request).encode()).hexdigest())
+
+
+def conditional_response(view, request, *args, scope="explore", **kwargs):
+    """ Answer revalidations of an unchanged resource with 304 Not Modified
+    before calling the view, and add ETag and Last-Modified headers to its
+    responses otherwise. The ETag depends on the data version, the url and
+    the negotiated format.
+    """
+    state = get_data_state(scope)
+    renderer = getattr(request, 'accepted_renderer', None)
+    key = "%s:%s:%s" % (state["version"], get_request_url(request), renderer.format if renderer else "")
+    etag = '"%s"' % hashlib.md5(key.encode()).hexdigest()
+    last_modified = int(state["modified"])
+    response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+    response = view(request, *args, **kwargs)
+    if response.status_code == 200 and not getattr(request, 'skip_response_cache', False):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class CachedResponseMixin:
+    """ Serve the serialized data of list and detail responses from the cache
+    until any of the explore models are written to, and answer conditional
+    requests for unchanged data without touching the database
+    """
+
+    def cached_response(self, view, request, *args, **kwargs):
+        return conditional_response(self.cache_lookup, request, view, *args, **kwargs)
+
+    def cache_lookup(self, request, view, *args, **kwargs):
+        key = get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not getattr(request, 'skip_response_cache', False):
+            cache.set(key, response.data, settings.EXPLORE_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,69 @@
+import base64
+import sys
+from array import array
+from django.db.models import FloatField, Func
+from .renderers import ORJSONRenderer
+
+# A compact format of the map layers with `format=columns`. Instead of one
+# GeoJSON feature per place, each property is one array over the places of
+# the page. Coordinates are base64 encoded little endian float32 arrays,
+# place types are given once in a lookup, and counts are a matrix with a row
+# per place and a column per key:
+#
+#   {"id": [...], "name": [...], "lon": "<base64>", "lat": "<base64>",
+#    "place_type": [...], "place_types": {"7": {"name": ..., "parent": 1}},
+#    "keys": [17, 18], "counts": [[2, 0], [0, 1]]}
+FORMAT = "columns"
+FIELDS = ["id", "name", "place_type_id", "place_type__name", "place_type__parent_id"]
+
+
+class X(Func):
+    function = "ST_X"
+    output_field = FloatField()
+
+
+class Y(Func):
+    function = "ST_Y"
+    output_field = FloatField()
+
+
+class ColumnarRenderer(ORJSONRenderer):
+    """ JSON with its own format, so that map views can tell when to build
+    columns
+    """
+    format = FORMAT
+
+
+def get_place_rows(queryset):
+    """ Return the places of a queryset as tuples of FIELDS and coordinates
+    """
+    return queryset.prefetch_related(None).values_list(*FIELDS, X("geometry"), Y("geometry"))
+
+
+def pack(values):
+    floats = array("f", values)
+    if sys.byteorder == "big":
+        floats.byteswap()
+    return base64.b64encode(floats.tobytes()).decode("ascii")
+
+
+def get_columns(rows, get_counts=None):
+    """ Turn place rows into columns, with the counts `get_counts` returns
+    for the place ids as {place_id: {key: count}}, if given
+    """
+    rows = list(rows)
+    ids = [row[0] for row in rows]
+    columns = {
+        "id": ids,
+        "name": [row[1] for row in rows],
+        "lon": pack([row[5] for row in rows]),
+        "lat": pack([row[6] for row in rows]),
+        "place_type": [row[2] for row in rows],
+        "place_types": {row[2]: {"name": row[3], "parent": row[4]} for row in rows},
+    }
+    counts = get_counts(ids) if get_counts is not None else None
+    if counts is not None:
+        keys = sorted({key for place_counts in counts.values() for key in place_counts}, key=int)
+        columns["keys"] = keys
+        columns["counts"] = [[counts[id].get(key, 0) for key in keys] for id in ids]
+    return columns
@@ -0,0 +1,106 @@
+import json
+from django.db.models import Prefetch
+from .models import Place, Cult, RelationCultAgent, RelationOtherAgent, RelationOtherPlace
+
+# Full dataset exports, written feature by feature from a server-side cursor
+# so that memory use stays the same however large the dataset grows.
+FORMATS = ["geojson", "ndjson"]
+
+
+def get_cults():
+    return Cult.objects.select_related("cult_type").prefetch_related(
+        Prefetch("relationcultagent_set", queryset=RelationCultAgent.objects.select_related("agent")),
+        Prefetch("relationotheragent_set", queryset=RelationOtherAgent.objects.select_related("agent", "role")))
+
+
+def get_places():
+    places = Place.objects.filter(exclude=False).select_related("place_type")
+    return places.prefetch_related(
+        Prefetch("relation_cult_place", queryset=get_cults()),
+        Prefetch("relationotherplace_set", queryset=RelationOtherPlace.objects.select_related("role"))).order_by("id")
+
+
+def get_cult(cult):
+    return {
+        "id": cult.id,
+        "cult_type": cult.cult_type_id,
+        "cult_type_name": cult.cult_type.name,
+        "time_period": cult.time_period,
+        "minyear": cult.minyear,
+        "maxyear": cult.maxyear,
+        "saints": [{
+            "id": relation.agent_id,
+            "name": relation.agent.name,
+            "agent_uncertainty": relation.agent_uncertainty,
+        } for relation in cult.relationcultagent_set.all()],
+        "people": [{
+            "id": relation.agent_id,
+            "name": relation.agent.name,
+            "role": relation.role.name,
+            "agent_uncertainty": relation.agent_uncertainty,
+        } for relation in cult.relationotheragent_set.all()],
+    }
+
+
+def get_feature(place):
+    return {
+        "type": "Feature",
+        "id": place.id,
+        "geometry": json.loads(place.geometry.geojson),
+        "properties": {
+            "name": place.name,
+            "place_type": place.place_type_id,
+            "place_type_name": place.place_type.name if place.place_type else None,
+            "parish": place.parish_id,
+            "cults": [get_cult(cult) for cult in place.relation_cult_place.all()],
+            # cults of other places this place has a role in
+            "other_cults": [{
+                "id": relation.cult_id,
+                "role": relation.role.name,
+                "place_uncertainty": relation.place_uncertainty,
+            } for relation in place.relationotherplace_set.all()],
+        },
+    }
+
+
+def get_placeless_feature(cult):
+    # a feature without a place, so that cults without one are exported too
+    return {
+        "type": "Feature",
+        "id": None,
+        "geometry": None,
+        "properties": {
+            "name": None,
+            "place_type": None,
+            "place_type_name": None,
+            "parish": None,
+            "cults": [get_cult(cult)],
+            "other_cults": [],
+        },
+    }
+
+
+def get_features(chunk_size):
+    for place in get_places().iterator(chunk_size=chunk_size):
+        yield get_feature(place)
+    for cult in get_cults().filter(place=None).order_by("id").iterator(chunk_size=chunk_size):
+        yield get_placeless_feature(cult)
+
+
+def export(format="geojson", chunk_size=500):
+    """ Yield all places with their cults and agents, followed by one feature
+    without geometry for each cult without a place, either as a GeoJSON
+    feature collection or as one GeoJSON feature per line. Places marked
+    as excluded are left out, and so are their cults.
+    """
+    features = get_features(chunk_size)
+    if format == "ndjson":
+        for feature in features:
+            yield json.dumps(feature) + "\n"
+    else:
+        yield '{"type": "FeatureCollection", "features": [\n'
+        separator = ""
+        for feature in features:
+            yield separator + json.dumps(feature)
+            separator = ",\n"
+        yield "\n]}\n"
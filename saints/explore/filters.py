@@ -0,0 +1,29 @@
+from django.contrib.postgres.search import SearchQuery
+from django.template import loader
+from rest_framework import filters
+
+
+class DocumentSearchFilter(filters.SearchFilter):
+    """ Search the precomputed search document of a model instead of joining
+    the tables of all search fields. With `search_type=fulltext` the search
+    uses full-text search with web search syntax instead of substrings.
+    Views need no search_fields.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        if request.query_params.get('search_type') == 'fulltext':
+            search = request.query_params.get(self.search_param)
+            return queryset.filter(search_vector=SearchQuery(search, config='simple', search_type='websearch'))
+        for term in terms:
+            queryset = queryset.filter(search_document__icontains=term)
+        return queryset
+
+    def to_html(self, request, queryset, view):
+        context = {
+            'param': self.search_param,
+            'term': request.query_params.get(self.search_param, ''),
+        }
+        return loader.get_template(self.template).render(context)
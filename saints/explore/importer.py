@@ -0,0 +1,155 @@
+import csv
+import json
+from django.contrib.gis.geos import Point
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from .cache import bump_data_version
+from .models import Agent, Cult, Place, RelationCultAgent, RelationOtherAgent, \
+    RelationOtherPlace, RelationQuote, parse_time_period, year_range
+from .search import DOCUMENTS, update_documents
+from .summary import update_map_summary
+
+# Imports rows of CSV or JSON lines files with bulk inserts. Columns are named
+# after the model fields. Foreign keys and many-to-many fields take ids, or
+# any unique field of the related model when named like `place_type__name`.
+# Many-to-many values are lists in JSON and comma separated in CSV. Places
+# can be given `lon` and `lat` columns instead of a geometry.
+MODELS = {
+    "places": Place,
+    "agents": Agent,
+    "cults": Cult,
+    "relationcultagent": RelationCultAgent,
+    "relationotheragent": RelationOtherAgent,
+    "relationotherplace": RelationOtherPlace,
+    "relationquote": RelationQuote,
+}
+
+
+def read_rows(path):
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as file:
+            yield from csv.DictReader(file)
+    else:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def is_blank(value):
+    return value is None or value == ""
+
+
+class Importer:
+    """ Builds instances of a model from rows and saves them in batches,
+    with the derived data bulk_create does not update through signals
+    """
+
+    def __init__(self, model, user=None):
+        self.model = model
+        self.user = user
+        self.fields = {}
+        for field in model._meta.concrete_fields:
+            self.fields[field.name] = field
+            self.fields[field.attname] = field
+        self.m2m_fields = {field.name: field for field in model._meta.many_to_many
+                           if field.remote_field.through._meta.auto_created}
+        self.lookups = {}
+        self.count = 0
+
+    def lookup(self, field, attr, value):
+        key = (field.name, attr)
+        if key not in self.lookups:
+            rows = field.related_model.objects.values_list(attr, "id")
+            self.lookups[key] = {str(natural_key): id for natural_key, id in rows}
+        try:
+            return self.lookups[key][str(value)]
+        except KeyError:
+            raise ValueError("No %s with %s %r" % (field.related_model._meta.verbose_name, attr, value))
+
+    def convert(self, field, value):
+        if is_blank(value) and not isinstance(field, (models.CharField, models.TextField)):
+            return None if field.null else field.get_default()
+        if field.is_relation:
+            return field.target_field.to_python(value)
+        return field.to_python(value)
+
+    def get_related_ids(self, field, attr, value):
+        if is_blank(value):
+            return []
+        values = value.split(",") if isinstance(value, str) else value
+        if attr:
+            return [self.lookup(field, attr, item.strip() if isinstance(item, str) else item) for item in values]
+        return [int(item) for item in values]
+
+    def build(self, row):
+        values = {}
+        related = {}
+        for column, value in row.items():
+            if column in ("lon", "lat"):
+                continue
+            name, _, attr = column.partition("__")
+            if name in self.m2m_fields:
+                related[name] = self.get_related_ids(self.m2m_fields[name], attr, value)
+                continue
+            if name not in self.fields:
+                raise ValueError("Unknown column %s" % column)
+            field = self.fields[name]
+            if field.is_relation and attr:
+                values[field.attname] = None if is_blank(value) else self.lookup(field, attr, value)
+            else:
+                values[field.attname] = self.convert(field, value)
+        if "lon" in row and "lat" in row:
+            values["geometry"] = Point(float(row["lon"]), float(row["lat"]), srid=4326)
+        if self.user is not None and "created" in self.fields:
+            values["created_id"] = values["modified_id"] = self.user.pk
+        obj = self.model(**values)
+        if isinstance(obj, Cult):
+            obj.minyear, obj.maxyear = parse_time_period(obj.time_period)
+            obj.years = year_range(obj.minyear, obj.maxyear)
+        return obj, related
+
+    def save(self, batch):
+        with transaction.atomic():
+            objs = self.model.objects.bulk_create([obj for obj, related in batch])
+            for name, field in self.m2m_fields.items():
+                through = field.remote_field.through
+                source = field.m2m_field_name() + "_id"
+                target = field.m2m_reverse_field_name() + "_id"
+                through.objects.bulk_create([
+                    through(**{source: obj.pk, target: id})
+                    for obj, (_, related) in zip(objs, batch) for id in related.get(name, [])
+                ], ignore_conflicts=True)
+            ids = [obj.pk for obj in objs]
+            if self.model in DOCUMENTS:
+                update_documents(self.model, ids)
+            if self.model is Cult:
+                update_map_summary(ids)
+            elif "cult" in self.fields:
+                cults = {obj.cult_id for obj in objs}
+                update_map_summary(cults)
+                update_documents(Cult, cults)
+        self.count += len(objs)
+
+    def run(self, rows, batch_size=1000):
+        batch = []
+        try:
+            for number, row in enumerate(rows, 1):
+                try:
+                    batch.append(self.build(row))
+                except (ValueError, TypeError, ValidationError) as e:
+                    raise ValueError("Row %d: %s" % (number, e))
+                if len(batch) == batch_size:
+                    self.save(batch)
+                    batch = []
+            if batch:
+                self.save(batch)
+        finally:
+            if self.count:
+                # rows may have been given their ids
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), [self.model]):
+                        cursor.execute(sql)
+                bump_data_version()
+        return self.count
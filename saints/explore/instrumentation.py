@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from rest_framework import permissions
+
+logger = logging.getLogger("explore.metrics")
+
+# A sample of METRICS_SAMPLE_RATE of all requests is measured, logged as one
+# JSON object per request and summed up per route and serializer in the
+# memory of each worker process.
+FIELDS = ["queries", "db_ms", "view_ms", "python_ms", "render_ms", "total_ms", "size"]
+stats = {}
+lock = threading.Lock()
+
+
+class QueryRecorder:
+    """ Counts and times the queries run on the connections it wraps
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+def record(sample):
+    with lock:
+        entry = stats.setdefault((sample["route"], sample["serializer"]), {
+            "requests": 0,
+            "sum": dict.fromkeys(FIELDS, 0),
+            "max": dict.fromkeys(FIELDS, 0),
+        })
+        entry["requests"] += 1
+        for field in FIELDS:
+            value = sample[field] or 0
+            entry["sum"][field] += value
+            entry["max"][field] = max(entry["max"][field], value)
+
+
+def get_stats():
+    with lock:
+        return [{
+            "route": route,
+            "serializer": serializer,
+            "requests": entry["requests"],
+            "mean": {field: round(value / entry["requests"], 2) for field, value in entry["sum"].items()},
+            "max": {field: round(value, 2) for field, value in entry["max"].items()},
+        } for (route, serializer), entry in sorted(stats.items(), key=lambda item: (item[0][0], item[0][1] or ""))]
+
+
+def get_pool_stats():
+    """ Sizes of the connection pools of this worker process and how long
+    requests waited for a connection, in psycopg_pool terms
+    """
+    pools = {}
+    for connection in connections.all():
+        pool = getattr(connection, "pool", None)
+        if pool is not None:
+            pools[connection.alias] = pool.get_stats()
+    return pools
+
+
+def get_serializer_name(response):
+    view = getattr(response, "renderer_context", {}).get("view")
+    try:
+        return view.get_serializer_class().__name__
+    except (AttributeError, AssertionError):
+        return None
+
+
+def ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class MetricsMiddleware:
+    """ Measures query count, database time, time spent in the view and the
+    part of it not spent waiting for the database, rendering time and
+    response size of sampled requests
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        metrics = request._metrics = {"recorder": recorder, "start": time.perf_counter()}
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        end = time.perf_counter()
+        view_end = metrics.get("view_end", end)
+        # time in the view not spent waiting for the database: filtering,
+        # pagination, cache lookups and serialization together
+        view_db = metrics.get("view_db", recorder.duration)
+        match = request.resolver_match
+        sample = {
+            "route": match.view_name if match else "unresolved",
+            "serializer": metrics.get("serializer"),
+            "method": request.method,
+            "status": response.status_code,
+            "queries": recorder.count,
+            "db_ms": ms(recorder.duration),
+            "view_ms": ms(view_end - metrics["start"]),
+            "python_ms": ms(max(view_end - metrics["start"] - view_db, 0)),
+            "render_ms": ms(metrics["render_end"] - view_end) if "render_end" in metrics else 0,
+            "total_ms": ms(end - metrics["start"]),
+            "size": None if response.streaming else len(response.content),
+            "pid": os.getpid(),
+        }
+        record(sample)
+        logger.info(json.dumps(sample))
+        return response
+
+    async def __acall__(self, request):
+        # under ASGI queries run in other threads than the middleware, out of
+        # reach of the execute wrappers, so requests are not sampled
+        return await self.get_response(request)
+
+    def process_template_response(self, request, response):
+        metrics = getattr(request, "_metrics", None)
+        if metrics is not None:
+            metrics["view_end"] = time.perf_counter()
+            metrics["view_db"] = metrics["recorder"].duration
+            metrics["serializer"] = get_serializer_name(response)
+            response.add_post_render_callback(lambda response: metrics.update(render_end=time.perf_counter()))
+        return response
+
+
+class IsInternal(permissions.BasePermission):
+    """ Allow staff and requests from INTERNAL_IPS only
+    """
+
+    def has_permission(self, request, view):
+        return request.user.is_staff or request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS
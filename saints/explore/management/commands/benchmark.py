@@ -0,0 +1,65 @@
+import json
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from explore import benchmark, synthetic
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark",
+    }
+}
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Measure query counts, latency and payload size of the API on a synthetic dataset in a test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=int, default=200, help="Number of places to generate")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--repeat", type=int, default=5, help="Number of times each request is run")
+        parser.add_argument("--output", help="File to write the JSON results to instead of stdout")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the test database between runs")
+        parser.add_argument("--renderers", action="store_true",
+                            help="Also compare the rendering time of the JSON renderers on map and detail responses")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            # a cache of its own, as responses are uncached before each request
+            with override_settings(METRICS_SAMPLE_RATE=0, CACHES=CACHES):
+                synthetic.generate(options["scale"], options["seed"])
+                results = benchmark.run(options["repeat"], renderers=options["renderers"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+        report = {
+            "commit": get_commit(),
+            "scale": options["scale"],
+            "seed": options["seed"],
+            "repeat": options["repeat"],
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+            for result in results:
+                self.stdout.write("%-50s %4d queries %9.2f ms p50 %9.2f ms p95 %9d bytes"
+                                  % (result["name"], result["queries"], result["p50_ms"], result["p95_ms"], result["size"]))
+                for format, renderer in (result.get("renderers") or {}).items():
+                    self.stdout.write("    %-46s %9.2f ms p50 %9.2f ms p95 %9d bytes"
+                                      % (format, renderer["p50_ms"], renderer["p95_ms"], renderer["size"]))
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,21 @@
+import sys
+from django.core.management.base import BaseCommand
+from explore.export import FORMATS, export
+
+
+class Command(BaseCommand):
+    help = "Export all places with their cults and agents as GeoJSON or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=FORMATS, default="geojson")
+        parser.add_argument("--output", help="File to write to instead of stdout")
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        output = open(options["output"], "w") if options["output"] else sys.stdout
+        try:
+            for chunk in export(options["format"], options["chunk_size"]):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,30 @@
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from explore.importer import MODELS, Importer, read_rows
+
+
+class Command(BaseCommand):
+    help = "Import places, agents, cults or their relations from a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", choices=MODELS)
+        parser.add_argument("path", help="A .csv file or a file with one JSON object per line")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--user", help="Username to record as creator of the imported objects")
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            try:
+                user = get_user_model().objects.get_by_natural_key(options["user"])
+            except get_user_model().DoesNotExist:
+                raise CommandError("No user %s" % options["user"])
+        importer = Importer(MODELS[options["model"]], user)
+        start = time.perf_counter()
+        try:
+            count = importer.run(read_rows(options["path"]), options["batch_size"])
+        except ValueError as e:
+            raise CommandError("%s, %d rows were imported before" % (e, importer.count))
+        seconds = time.perf_counter() - start
+        self.stdout.write("Imported %d %s in %.2f s" % (count, options["model"], seconds))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from explore.cache import bump_data_version
+from explore.models import Cult
+from explore.summary import update_map_summary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the summary the map layers are filtered and counted by"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        ids = list(Cult.objects.order_by("id").values_list("id", flat=True))
+        rows = 0
+        for start in range(0, len(ids), chunk_size):
+            rows += update_map_summary(ids[start:start + chunk_size])
+        bump_data_version()
+        self.stdout.write("Updated %d map summary rows of %d cults" % (rows, len(ids)))
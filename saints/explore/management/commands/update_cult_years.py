@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from explore.cache import bump_data_version
+from explore.models import Cult, parse_time_period, year_range
+from explore.summary import update_map_summary
+
+
+class Command(BaseCommand):
+    help = "Derive minyear, maxyear and the year ranges of all cults from their time periods"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def update(self, cults):
+        with transaction.atomic():
+            Cult.objects.bulk_update(cults, ["minyear", "maxyear", "years"])
+            # bulk_update bypasses the signals keeping the summary up to date
+            update_map_summary([cult.id for cult in cults])
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        start = time.perf_counter()
+        total = 0
+        updated = 0
+        changed = []
+        rows = Cult.objects.order_by("id").values_list("id", "time_period", "minyear", "maxyear", "years")
+        for id, time_period, minyear, maxyear, years in rows.iterator(chunk_size=chunk_size):
+            total += 1
+            new_minyear, new_maxyear = parse_time_period(time_period)
+            new_years = year_range(new_minyear, new_maxyear)
+            if (new_minyear, new_maxyear, new_years) != (minyear, maxyear, years):
+                changed.append(Cult(id=id, minyear=new_minyear, maxyear=new_maxyear, years=new_years))
+            if len(changed) == chunk_size:
+                self.update(changed)
+                updated += len(changed)
+                changed = []
+        if changed:
+            self.update(changed)
+            updated += len(changed)
+        if updated:
+            bump_data_version()
+        seconds = time.perf_counter() - start
+        self.stdout.write("Updated %d of %d cults in %.2f s (%d cults/s)"
+                          % (updated, total, seconds, total / seconds if seconds else 0))
@@ -0,0 +1,14 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from explore.models import CultType, PlaceType
+
+
+class Command(BaseCommand):
+    help = "Recompute the lineage of all cult types and place types, and the map summary built from it"
+
+    def handle(self, *args, **options):
+        for model in (CultType, PlaceType):
+            count = model.rebuild_lineage()
+            self.stdout.write("Updated %d %s" % (count, model._meta.verbose_name_plural))
+        # the summary holds the lineage of the type of every cult
+        call_command("rebuild_map_summary", stdout=self.stdout)
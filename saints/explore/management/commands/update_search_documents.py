@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from explore.search import DOCUMENTS, update_documents
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search documents of all searchable models"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        for model in DOCUMENTS:
+            ids = list(model.objects.order_by("id").values_list("id", flat=True))
+            for start in range(0, len(ids), chunk_size):
+                update_documents(model, ids[start:start + chunk_size])
+            self.stdout.write("Updated %d %s" % (len(ids), model._meta.verbose_name_plural))
@@ -2,6 +2,11 @@ from django.db import models
 from django.conf import settings
 from django.contrib.gis.db import models as gis_models
 from django.contrib.gis.geos import Point
+from django.contrib.postgres.fields import ArrayField, IntegerRangeField
+from django.contrib.postgres.indexes import GinIndex, GistIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Upper
+from django.db.backends.postgresql.psycopg_any import NumericRange
 from ckeditor.fields import RichTextField
 import re
 
@@ -85,6 +90,92 @@ class TypeMixin(models.Model):
         abstract = True
 
 
+class SearchMixin(models.Model):
+    search_document = models.TextField(blank=True, editable=False,
+                                       help_text="Automatically filled with all searchable names and texts.")
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+
+def search_indexes(prefix):
+    # icontains compares UPPER(search_document), so the trigram index has to as well
+    return [
+        GinIndex(fields=["search_vector"], name="%s_search_vector" % prefix),
+        GinIndex(OpClass(Upper("search_document"), name="gin_trgm_ops"), name="%s_search_trgm" % prefix),
+    ]
+
+
+DATE_ONLY = re.compile(r"^(\d+)(-\d+-\d+)?$")
+YEAR_RANGE = re.compile(r"^(\d+)-(\d+)$")
+
+
+def parse_period(period, start):
+    if period in TIME_PERIOD_MAP:
+        return TIME_PERIOD_MAP[period]
+    date_only = DATE_ONLY.match(period)
+    if date_only:
+        return int(date_only.group(1))
+    range_match = YEAR_RANGE.match(period)
+    if range_match:
+        return int(range_match.group(1 if start else 2))
+    return 0
+
+
+def parse_time_period(time_period):
+    """ Return the first and last year of a cult's time period, formatted as
+    YYYY or YYYY_YYYY or YYYY-YYYY_YYYY-YYYY or encoded as in TIME_PERIOD_MAP
+    """
+    periods = time_period.split('_')
+    if len(periods) == 2:
+        return parse_period(periods[0], True), parse_period(periods[1], False)
+    return parse_period(time_period, True), parse_period(time_period, False)
+
+
+def year_range(minyear, maxyear):
+    """ Return the inclusive range of years to store in or compare with the
+    `years` fields, in the canonical form postgres returns int4ranges in
+    """
+    return NumericRange(min(minyear, maxyear), max(minyear, maxyear) + 1)
+
+
+class LineageMixin(models.Model):
+    """ Keeps the ids of a type and of all its ancestors in `lineage`, so that
+    filtering by any level of the hierarchy is a single array lookup. Saves
+    update it through a post_save receiver, see signals.py.
+    """
+    lineage = ArrayField(models.BigIntegerField(), default=list, editable=False,
+                         help_text="Automatically filled with the ids of the type and its parents during save.")
+
+    def update_lineage(self):
+        lineage = [self.pk]
+        if self.parent_id is not None:
+            parent_lineage = type(self).objects.values_list("lineage", flat=True).get(pk=self.parent_id)
+            if self.pk not in parent_lineage:
+                lineage += parent_lineage
+        if lineage != self.lineage:
+            self.lineage = lineage
+            type(self).objects.filter(pk=self.pk).update(lineage=lineage)
+            for child in type(self).objects.filter(parent=self.pk):
+                child.update_lineage()
+
+    @classmethod
+    def rebuild_lineage(cls):
+        parents = dict(cls.objects.values_list("id", "parent_id"))
+        types = []
+        for id in parents:
+            lineage = [id]
+            while parents.get(lineage[-1]) is not None and parents[lineage[-1]] not in lineage:
+                lineage.append(parents[lineage[-1]])
+            types.append(cls(id=id, lineage=lineage))
+        cls.objects.bulk_update(types, ["lineage"], batch_size=1000)
+        return len(types)
+
+    class Meta:
+        abstract = True
+
+
 # Type models
 class AgentType(TypeMixin):
     # TODO: limit choices
@@ -99,7 +190,7 @@ class OrganizationType(TypeMixin):
     pass
 
 
-class PlaceType(TypeMixin):
+class PlaceType(TypeMixin, LineageMixin):
     PLACE_TYPES = {
         "Place Type": "Place Type",
         "Subcategory": "Subcategory",
@@ -111,8 +202,13 @@ class PlaceType(TypeMixin):
     level = models.CharField(max_length=15, choices=PLACE_TYPES)
     aat = models.URLField(blank=True)
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=["lineage"]),
+        ]
 
-class CultType(TypeMixin):
+
+class CultType(TypeMixin, LineageMixin):
     CULT_TYPES = {
         "Type of Evidence": "Type of Evidence",
         "Intermediate": "Intermediate",
@@ -127,6 +223,9 @@ class CultType(TypeMixin):
     class Meta:
         verbose_name = "Cult Manifestation Type"
         verbose_name_plural = "Cult Manifestation Types"
+        indexes = [
+            GinIndex(fields=["lineage"]),
+        ]
 
 
 # Relation models
@@ -224,7 +323,7 @@ class RelationOtherPlace(models.Model):
 
 
 # Core models
-class Organization(EntityMixin, NotesMixin, DatesMixin):
+class Organization(EntityMixin, NotesMixin, DatesMixin, SearchMixin):
     name = models.CharField(max_length=255, help_text="Name in English")
     wikidata = models.URLField(blank=True)
     parent = models.ForeignKey("self", on_delete=models.SET_NULL, null=True, blank=True)
@@ -235,8 +334,11 @@ class Organization(EntityMixin, NotesMixin, DatesMixin):
             return ""
         return "|".join(filter(None, [self.name, self.organization_type.name]))
 
+    class Meta:
+        indexes = search_indexes("organization")
+
 
-class Agent(EntityMixin, NotesMixin):
+class Agent(EntityMixin, NotesMixin, SearchMixin):
     GENDER_TYPES = {
         "Man": "Man",
         "Woman": "Woman",
@@ -256,8 +358,11 @@ class Agent(EntityMixin, NotesMixin):
     def __str__(self):
         return "|".join(filter(None, [self.name, self.gender, self.not_before]))
 
+    class Meta:
+        indexes = search_indexes("agent")
+
 
-class Place(EntityMixin, NotesMixin, DatesMixin):
+class Place(EntityMixin, NotesMixin, DatesMixin, SearchMixin):
     INDICATION_TYPES = {
         "Written": "Written",
         "Artefact": "Artefact",
@@ -287,8 +392,11 @@ class Place(EntityMixin, NotesMixin, DatesMixin):
     def __str__(self):
         return "|".join(filter(None, [self.name, self.municipality, self.place_type.name]))
 
+    class Meta:
+        indexes = search_indexes("place")
+
 
-class Cult(EntityMixin, NotesMixin, DatesMixin):
+class Cult(EntityMixin, NotesMixin, DatesMixin, SearchMixin):
     EXTANT_TYPES = {
         "Extant": "Extant",
         "Lost": "Lost",
@@ -307,6 +415,7 @@ class Cult(EntityMixin, NotesMixin, DatesMixin):
     time_period = models.CharField(max_length=255, blank=True, verbose_name="Function time-period", help_text="Format YYYY or YYYY_YYYY or YYYY-YYYY_YYYY-YYYY or encoded like 3-3_2-2.")
     minyear = models.PositiveSmallIntegerField(default=0, help_text="Automatically filled with lowest value of Function time-period during save.")
     maxyear = models.PositiveSmallIntegerField(default=0, help_text="Automatically filled with highest value of Function time-period during save.")
+    years = IntegerRangeField(null=True, editable=False, help_text="Automatically filled with the range from minyear to maxyear during save.")
     production_date = models.CharField(max_length=21, blank=True)
     extant = models.CharField(max_length=10, choices=EXTANT_TYPES, default="N/A")
     colour = models.CharField(max_length=10, choices=COLOUR, blank=True)
@@ -329,40 +438,12 @@ class Cult(EntityMixin, NotesMixin, DatesMixin):
     relation_iconographic = models.ManyToManyField("Iconographic", through=RelationIconographic, blank=True)
 
     def translate_time_period(self, start):
-        # Split the time period by underscores
-        result = 0
-        time_periods = self.time_period.split('_')
-        if len(time_periods) == 2:
-            if start:
-                period = time_periods[0]
-            else:
-                period = time_periods[1]
-        else:
-            period = self.time_period
-
-        if period in TIME_PERIOD_MAP:
-            result = TIME_PERIOD_MAP[period]
-        else:
-            date_only = re.match(r"^(\d+)(-\d+-\d+)?$", period)
-            range_match = re.match(r"^(\d+)-(\d+)$", period)
-            if date_only:
-                result = int(date_only.group(1))
-            else:
-                if range_match and start:
-                    result = int(range_match.group(1))
-                elif range_match:
-                    result = int(range_match.group(2))
-
-        return result
+        return parse_time_period(self.time_period)[0 if start else 1]
 
     def save(self, *args, **kwargs):
-        # Automatically compute the min_year field when saving
-        new_start = self.translate_time_period(True)
-        new_end = self.translate_time_period(False)
-        if self.minyear == 0 or self.minyear != new_start:
-            self.minyear = new_start
-        if self.maxyear == 0 or self.maxyear != new_end:
-            self.maxyear = new_end
+        # Automatically compute the minyear and maxyear fields when saving
+        self.minyear, self.maxyear = parse_time_period(self.time_period)
+        self.years = year_range(self.minyear, self.maxyear)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -371,6 +452,9 @@ class Cult(EntityMixin, NotesMixin, DatesMixin):
     class Meta:
         verbose_name = "Cult Manifestation"
         verbose_name_plural = "Cult Manifestations"
+        indexes = search_indexes("cult") + [
+            GistIndex(fields=["years"]),
+        ]
 
 
 class Parish(EntityMixin, NotesMixin, DatesMixin):
@@ -423,7 +507,7 @@ class Source(EntityMixin, NotesMixin):
         return "|".join(filter(None, [self.name, self.author, self.pub_year]))
 
 
-class Quote(EntityMixin, NotesMixin, DatesMixin):
+class Quote(EntityMixin, NotesMixin, DatesMixin, SearchMixin):
     source = models.ForeignKey(Source, on_delete=models.RESTRICT, null=True, related_name="source_quote")
     page = models.CharField(max_length=255, blank=True, help_text="Page or folio")
     language = models.CharField(max_length=4, blank=True, choices=LANGUAGES)
@@ -439,6 +523,9 @@ class Quote(EntityMixin, NotesMixin, DatesMixin):
         else:
             return self.page
 
+    class Meta:
+        indexes = search_indexes("quote")
+
 
 # needed here as we can't have foreign key in other database
 # not going to change overly complicated data structure for now
@@ -480,6 +567,11 @@ class Iconographic(DatesMixin):
     def __str__(self):
         return "|".join(filter(None, [self.church, self.motif2]))
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["volume", "card"]),
+        ]
+
 
 class FeastDay(EntityMixin):
     day = models.CharField(max_length=5, help_text="Day in format 00-00 or * for recurring events")
@@ -507,3 +599,32 @@ class PlaceName(NameMixin):
 
 class ParishName(NameMixin):
     parish = models.ForeignKey(Parish, on_delete=models.CASCADE)
+
+
+# Derived models
+class MapSummary(models.Model):
+    """ One row for every cult and place it is shown at on the map, its own
+    place or one related through RelationOtherPlace, with everything the map
+    layers filter and count by. Kept up to date by signals, see summary.py.
+    """
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name="map_summary")
+    cult = models.ForeignKey(Cult, on_delete=models.CASCADE, related_name="map_summary")
+    own = models.BooleanField(default=True, help_text="Is this the place of the cult?")
+    cult_type = models.ForeignKey(CultType, on_delete=models.CASCADE, related_name="+")
+    cult_types = ArrayField(models.BigIntegerField(), default=list, help_text="Lineage of the cult type.")
+    years = IntegerRangeField(null=True)
+    # one entry per relation and per relation and agent type, so that
+    # counting entries gives the same numbers as counting joined rows
+    saint_ids = ArrayField(models.BigIntegerField(), default=list)
+    saint_types = ArrayField(models.BigIntegerField(), default=list)
+    people_ids = ArrayField(models.BigIntegerField(), default=list)
+    people_types = ArrayField(models.BigIntegerField(), default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["place", "cult"], name="mapsummary_place_cult"),
+        ]
+        indexes = [
+            GinIndex(fields=["cult_types"]),
+            GistIndex(fields=["years"]),
+        ]
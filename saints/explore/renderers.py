@@ -0,0 +1,36 @@
+import json
+from django.contrib.gis.geos import GEOSGeometry
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Types orjson leaves to default(). Dates and times are passed through so
+# that they are formatted like by DRF's encoder.
+encoder = JSONEncoder()
+
+
+def default(obj):
+    if isinstance(obj, GEOSGeometry):
+        return json.loads(obj.geojson)
+    return encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """ The same JSON as JSONRenderer, encoded with orjson if it is installed.
+    JSONRenderer remains available with `format=json`.
+    """
+    format = "orjson"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=default, option=options)
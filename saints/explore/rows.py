@@ -0,0 +1,149 @@
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from .models import RelationCultAgent
+from .serializers import AgentMiniSerializer, AgentTypeSerializer, \
+    CultMiniSerializer, CultTypeSerializer, OrganizationMiniSerializer, \
+    PlaceMiniSerializer, PlaceTypeSerializer, QuoteMiniSerializer
+
+# Serializers for flat, fixed shape lists that read the rows of
+# queryset.values() instead of model instances. They give the same data as
+# the model serializer they mirror, with the getter of every field worked out
+# once instead of going through DRF's field machinery for every row.
+METHOD, NESTED, VALUE = range(3)
+# fields whose representation is the value the database returns
+PLAIN_FIELDS = (
+    serializers.BooleanField, serializers.CharField, serializers.ChoiceField,
+    serializers.IntegerField, serializers.ReadOnlyField, PrimaryKeyRelatedField,
+)
+# getters of each row serializer class, worked out on first use
+GETTERS = {}
+
+
+def get_getters(serializer, prefix=""):
+    """ Return the values() lookups the fields of a serializer read, and a
+    (name, kind, lookup, getter) tuple for each field
+    """
+    lookups = []
+    getters = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        lookup = prefix + field.source.replace(".", "__")
+        if isinstance(field, serializers.SerializerMethodField) and not prefix:
+            getters.append((name, METHOD, None, None))
+        elif isinstance(field, serializers.Serializer):
+            # a missing related row has a null primary key
+            pk = "%s__%s" % (lookup, field.Meta.model._meta.pk.attname)
+            nested_lookups, nested_getters = get_getters(field, lookup + "__")
+            lookups += [pk] + nested_lookups
+            getters.append((name, NESTED, pk, nested_getters))
+        elif isinstance(field, (serializers.SerializerMethodField, serializers.BaseSerializer, ManyRelatedField)):
+            raise ImproperlyConfigured("Field %s of %s can't be read from rows"
+                                       % (name, type(serializer).__name__))
+        else:
+            lookups.append(lookup)
+            getters.append((name, VALUE, lookup, None if isinstance(field, PLAIN_FIELDS) else field.to_representation))
+    return lookups, getters
+
+
+class RowSerializer:
+    """ Serializes rows of queryset.values() like `serializer_class`. Method
+    fields are served by get_<name>(row) methods, which can use what load()
+    looks up for all rows at once.
+    """
+    serializer_class = None
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @classmethod
+    def get_getters(cls):
+        if cls not in GETTERS:
+            GETTERS[cls] = get_getters(cls.serializer_class())
+        return GETTERS[cls]
+
+    @classmethod
+    def prepare(cls, queryset, *extra):
+        """ Turn a queryset into the rows the serializer reads, with `extra`
+        lookups such as the fields keyset pagination orders by
+        """
+        lookups, getters = cls.get_getters()
+        return queryset.prefetch_related(None).values(*dict.fromkeys(lookups + list(extra)))
+
+    def load(self, rows):
+        pass
+
+    def represent(self, row, getters):
+        data = {}
+        for name, kind, lookup, getter in getters:
+            if kind == METHOD:
+                data[name] = getattr(self, "get_" + name)(row)
+            elif row[lookup] is None:
+                data[name] = None
+            elif kind == NESTED:
+                data[name] = self.represent(row, getter)
+            else:
+                data[name] = row[lookup] if getter is None else getter(row[lookup])
+        return data
+
+    def to_representation(self, row):
+        return self.represent(row, self.get_getters()[1])
+
+    @property
+    def data(self):
+        rows = list(self.instance) if self.many else [self.instance]
+        self.load(rows)
+        data = [self.to_representation(row) for row in rows]
+        return data if self.many else data[0]
+
+
+class AgentMiniRowSerializer(RowSerializer):
+    serializer_class = AgentMiniSerializer
+
+
+class OrganizationMiniRowSerializer(RowSerializer):
+    serializer_class = OrganizationMiniSerializer
+
+
+class PlaceMiniRowSerializer(RowSerializer):
+    serializer_class = PlaceMiniSerializer
+
+
+class QuoteMiniRowSerializer(RowSerializer):
+    serializer_class = QuoteMiniSerializer
+
+
+class AgentTypeRowSerializer(RowSerializer):
+    serializer_class = AgentTypeSerializer
+
+
+class PlaceTypeRowSerializer(RowSerializer):
+    serializer_class = PlaceTypeSerializer
+
+
+class CultTypeRowSerializer(RowSerializer):
+    serializer_class = CultTypeSerializer
+
+
+class CultMiniRowSerializer(RowSerializer):
+    serializer_class = CultMiniSerializer
+    agents = None
+
+    def load(self, rows):
+        # the names of the agents of all cults with one query
+        self.agents = {}
+        if rows:
+            relations = RelationCultAgent.objects.filter(cult_id__in=[row["id"] for row in rows])
+            for cult_id, name in relations.order_by("id").values_list("cult_id", "agent__name"):
+                self.agents.setdefault(cult_id, []).append(name)
+
+    def get_relation_cult_agent(self, row):
+        names = self.agents.get(row["id"])
+        if names:
+            if len(names) > 1:
+                return names[0] + " and others"
+            else:
+                return names[0]
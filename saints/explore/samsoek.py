@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# K-samsök records are cached for SAMSOEK_TTL seconds and then served stale
+# for up to SAMSOEK_STALE_TTL seconds while being refreshed in the
+# background. Records that are not cached at all are fetched in the
+# background too, and given as None until then, so that requests never
+# wait for K-samsök. Async views fetch missing records with aget_resources
+# on the event loop.
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_maxsize=settings.SAMSOEK_WORKERS))
+session.mount("https://", HTTPAdapter(pool_maxsize=settings.SAMSOEK_WORKERS))
+executor = ThreadPoolExecutor(max_workers=settings.SAMSOEK_WORKERS, thread_name_prefix="samsoek")
+pending = {}
+lock = threading.Lock()
+
+
+def get_cache_key(resource_uri):
+    return "samsoek:%s" % hashlib.md5(resource_uri.encode()).hexdigest()
+
+
+def get_json_uri(resource_uri):
+    parts = resource_uri.split('/')
+    id = parts.pop()
+    json_uri = urlsplit('/'.join(parts) + '/jsonld/' + id)
+    if settings.SAMSOEK_URL:
+        # e.g. a local stub server in tests
+        base = urlsplit(settings.SAMSOEK_URL)
+        json_uri = json_uri._replace(scheme=base.scheme, netloc=base.netloc)
+    return json_uri.geturl()
+
+
+def parse(json_obj):
+    res = {'images': [], 'name': '', 'main_thumb': ''}
+    for item in json_obj['@graph']:
+        if item['@type'] == 'Image':
+            res['images'].append({'filename': item['lowresSource'], 'thumbnail': item['thumbnailSource']})
+        elif item['@type'] == 'ItemName':
+            if 'name' in item:
+                res['name'] = item['name'].title()
+        elif item['@type'] == 'Entity':
+            res['main_thumb'] = item['thumbnail']
+    # find higher resolution version
+    for image in res['images']:
+        if image['thumbnail'] == res['main_thumb']:
+            res['main_thumb'] = image['filename']
+    res['images'] = sorted(res['images'], key=lambda d: d['filename'])
+    return res
+
+
+def get_entry(res):
+    """ Return the cache entry of a record and its timeout
+    """
+    ttl = settings.SAMSOEK_TTL if res is not None else settings.SAMSOEK_ERROR_TTL
+    return {'data': res, 'expires': time.time() + ttl}, ttl + settings.SAMSOEK_STALE_TTL
+
+
+def fetch(resource_uri):
+    """ Fetch a record from K-samsök and store it in the cache
+    """
+    try:
+        response = session.get(get_json_uri(resource_uri), timeout=settings.SAMSOEK_TIMEOUT)
+        response.raise_for_status()
+        res = parse(response.json())
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+        logger.warning("Could not fetch %s from K-samsök: %s", resource_uri, e)
+        res = None
+    try:
+        cache.set(get_cache_key(resource_uri), *get_entry(res))
+    finally:
+        with lock:
+            pending.pop(resource_uri, None)
+    return res
+
+
+def refresh(resource_uri):
+    with lock:
+        if resource_uri not in pending:
+            pending[resource_uri] = executor.submit(fetch, resource_uri)
+        return pending[resource_uri]
+
+
+def get_resources(resource_uris):
+    """ Return the parsed K-samsök records for the given resource uris.
+    Missing records are returned as None and fetched concurrently in the
+    background.
+    """
+    keys = {uri: get_cache_key(uri) for uri in resource_uris}
+    entries = cache.get_many(keys.values())
+    now = time.time()
+    res = {}
+    for uri, key in keys.items():
+        entry = entries.get(key)
+        if entry is None:
+            refresh(uri)
+            res[uri] = None
+        else:
+            res[uri] = entry['data']
+            if entry['expires'] < now:
+                refresh(uri)
+    return res
+
+
+async def afetch(client, resource_uri):
+    """ Fetch a record from K-samsök without blocking and store it in the
+    cache
+    """
+    try:
+        response = await client.get(get_json_uri(resource_uri))
+        response.raise_for_status()
+        res = parse(response.json())
+    except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Could not fetch %s from K-samsök: %s", resource_uri, e)
+        res = None
+    await cache.aset(get_cache_key(resource_uri), *get_entry(res))
+    return res
+
+
+async def aget_resources(resource_uris):
+    """ Like get_resources, for async views. Missing records are fetched
+    concurrently on the event loop, stale ones are refreshed in the
+    background threads.
+    """
+    keys = {uri: get_cache_key(uri) for uri in resource_uris}
+    entries = await cache.aget_many(keys.values())
+    now = time.time()
+    res = {}
+    missing = []
+    for uri, key in keys.items():
+        entry = entries.get(key)
+        if entry is None:
+            missing.append(uri)
+        else:
+            res[uri] = entry['data']
+            if entry['expires'] < now:
+                refresh(uri)
+    if missing:
+        limits = httpx.Limits(max_connections=settings.SAMSOEK_WORKERS)
+        async with httpx.AsyncClient(timeout=settings.SAMSOEK_TIMEOUT, limits=limits) as client:
+            records = await asyncio.gather(*[afetch(client, uri) for uri in missing])
+        res.update(zip(missing, records))
+    return res
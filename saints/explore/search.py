@@ -0,0 +1,124 @@
+from collections import defaultdict
+from django.contrib.postgres.search import SearchVector
+from django.utils.html import strip_tags
+from .models import Agent, AgentName, Cult, CultType, FeastDay, \
+    Organization, OrganizationName, Parish, ParishName, Place, PlaceName, \
+    Quote, RelationCultAgent, RelationOtherAgent
+
+# Search documents hold all text an entity can be found by, e.g. its names in
+# all languages, in a single trigram and full-text indexed column.
+
+
+def collect(documents, rows):
+    for id, text in rows:
+        if text:
+            documents[id].append(strip_tags(text))
+
+
+def get_agent_documents(ids):
+    documents = defaultdict(list)
+    collect(documents, Agent.objects.filter(id__in=ids).values_list("id", "name"))
+    collect(documents, AgentName.objects.filter(agent__in=ids).values_list("agent_id", "name"))
+    collect(documents, FeastDay.objects.filter(agent__in=ids).values_list("agent_id", "day"))
+    return documents
+
+
+def get_place_documents(ids):
+    documents = defaultdict(list)
+    collect(documents, Place.objects.filter(id__in=ids).values_list("id", "name"))
+    collect(documents, PlaceName.objects.filter(place__in=ids).values_list("place_id", "name"))
+    # parishes have no search of their own, places are found by their names
+    collect(documents, Place.objects.filter(id__in=ids).values_list("id", "parish__name"))
+    collect(documents, Place.objects.filter(id__in=ids).values_list("id", "parish__parishname__name"))
+    return documents
+
+
+def get_cult_documents(ids):
+    documents = defaultdict(list)
+    cults = Cult.objects.filter(id__in=ids)
+    collect(documents, cults.values_list("id", "place__name"))
+    collect(documents, cults.values_list("id", "cult_type__name"))
+    collect(documents, cults.values_list("id", "feast_day"))
+    collect(documents, RelationCultAgent.objects.filter(cult__in=ids).values_list("cult_id", "agent__name"))
+    collect(documents, RelationOtherAgent.objects.filter(cult__in=ids).values_list("cult_id", "agent__name"))
+    return documents
+
+
+def get_quote_documents(ids):
+    documents = defaultdict(list)
+    quotes = Quote.objects.filter(id__in=ids)
+    collect(documents, quotes.values_list("id", "quote_transcription"))
+    collect(documents, quotes.values_list("id", "translation"))
+    collect(documents, quotes.values_list("id", "comment"))
+    return documents
+
+
+def get_organization_documents(ids):
+    documents = defaultdict(list)
+    collect(documents, Organization.objects.filter(id__in=ids).values_list("id", "name"))
+    collect(documents, OrganizationName.objects.filter(organization__in=ids).values_list("organization_id", "name"))
+    return documents
+
+
+DOCUMENTS = {
+    Agent: get_agent_documents,
+    Place: get_place_documents,
+    Cult: get_cult_documents,
+    Quote: get_quote_documents,
+    Organization: get_organization_documents,
+}
+
+
+def update_documents(model, ids):
+    """ Rebuild the search documents of the given objects
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    documents = DOCUMENTS[model](ids)
+    objs = [model(id=id, search_document="\n".join(documents[id])) for id in ids]
+    model.objects.bulk_update(objs, ["search_document"], batch_size=1000)
+    # bypasses save and signals, so this does not trigger another update
+    model.objects.filter(id__in=ids).update(search_vector=SearchVector("search_document", config="simple"))
+    return len(ids)
+
+
+# models whose text is part of a search document
+SOURCES = (
+    Agent, AgentName, FeastDay, Place, PlaceName, Parish, ParishName, Cult,
+    RelationCultAgent, RelationOtherAgent, CultType, Quote, Organization,
+    OrganizationName,
+)
+
+
+def get_dependent_documents(instance):
+    """ Return the (model, ids) pairs of the search documents that contain
+    text of the given object
+    """
+    if isinstance(instance, Agent):
+        cults = RelationCultAgent.objects.filter(agent=instance.pk).values_list("cult_id", flat=True).union(
+            RelationOtherAgent.objects.filter(agent=instance.pk).values_list("cult_id", flat=True))
+        return [(Agent, [instance.pk]), (Cult, cults)]
+    elif isinstance(instance, (AgentName, FeastDay)):
+        return [(Agent, [instance.agent_id])]
+    elif isinstance(instance, Place):
+        return [(Place, [instance.pk]), (Cult, Cult.objects.filter(place=instance.pk).values_list("id", flat=True))]
+    elif isinstance(instance, PlaceName):
+        return [(Place, [instance.place_id])]
+    elif isinstance(instance, Parish):
+        return [(Place, Place.objects.filter(parish=instance.pk).values_list("id", flat=True))]
+    elif isinstance(instance, ParishName):
+        return [(Place, Place.objects.filter(parish=instance.parish_id).values_list("id", flat=True))]
+    elif isinstance(instance, Cult):
+        return [(Cult, [instance.pk])]
+    elif isinstance(instance, (RelationCultAgent, RelationOtherAgent)):
+        return [(Cult, [instance.cult_id])]
+    elif isinstance(instance, CultType):
+        return [(Cult, Cult.objects.filter(cult_type=instance.pk).values_list("id", flat=True))]
+    elif isinstance(instance, Quote):
+        return [(Quote, [instance.pk])]
+    elif isinstance(instance, Organization):
+        return [(Organization, [instance.pk])]
+    elif isinstance(instance, OrganizationName):
+        return [(Organization, [instance.organization_id])]
+    return []
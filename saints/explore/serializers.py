@@ -1,16 +1,47 @@
 from rest_framework import serializers
-from rest_framework_gis.serializers import GeoFeatureModelSerializer
+from rest_framework_gis.serializers import GeoFeatureModelSerializer, \
+    GeoFeatureModelListSerializer
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db.models import Manager
 from .models import Agent, AgentType, AgentName, Place, PlaceName, PlaceType, \
     Cult, CultType, Source, Parish, Quote, Organization, FeastDay, \
     OrganizationType, RelationCultAgent, RelationOffice, \
     RelationDigitalResource, Iconographic, RelationMBResource, \
     RelationOtherAgent, RelationOtherPlace
-import requests
+from .aggregates import cult_type_counts, agent_counts, \
+    place_cult_type_counts
+from . import samsoek
 from itertools import chain
 
 
+def get_prefetched(manager):
+    """ Return the objects of a related manager from the prefetch cache, or
+    None when the view did not prefetch them
+    """
+    cache = getattr(manager.instance, '_prefetched_objects_cache', {})
+    name = getattr(manager, 'prefetch_cache_name', None) or manager.field.remote_field.cache_name
+    return cache.get(name)
+
+
+def related_values(manager, *fields):
+    """ manager.values(*fields), served from memory when prefetched
+    """
+    objects = get_prefetched(manager)
+    if objects is None:
+        return list(manager.values(*fields))
+    return [{field: getattr(obj, field) for field in fields} for obj in objects]
+
+
+def related_ordered(manager, field):
+    """ manager.order_by(field), sorted in memory when prefetched, with nulls
+    last like in the database
+    """
+    objects = get_prefetched(manager)
+    if objects is None:
+        return manager.order_by(field)
+    return sorted(objects, key=lambda obj: (getattr(obj, field) is None, getattr(obj, field) or ''))
+
+
 class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -65,11 +96,11 @@ class OrganizationSerializer(serializers.ModelSerializer):
     organization_names = serializers.SerializerMethodField()
 
     def get_organization_names(self, obj):
-        return obj.organizationname_set.all().values('name', 'language', 'not_before')
+        return related_values(obj.organizationname_set, 'name', 'language', 'not_before')
 
     class Meta:
         model = Organization
-        exclude = ['created', 'modified', 'updated', 'notes']
+        exclude = ['created', 'modified', 'updated', 'notes', 'search_document', 'search_vector']
 
 
 class RelationOfficeSerializer(serializers.ModelSerializer):
@@ -104,46 +135,48 @@ class DigitalResourceRelationSerializer(serializers.ModelSerializer):
         fields = ['resource_uri', 'resource_uncertainty']
 
 
+def skip_response_cache(context):
+    # don't keep responses with missing K-samsök records in the response cache
+    if 'request' in context:
+        context['request'].skip_response_cache = True
+
+
+class MBResourceListSerializer(serializers.ListSerializer):
+    """ Look up the K-samsök records of all resources in one go, unless an
+    async view already fetched them into the context
+    """
+
+    def to_representation(self, data):
+        resources = list(data.all() if isinstance(data, Manager) else data)
+        records = self.context.get('samsoek')
+        if records is None:
+            records = samsoek.get_resources([resource.resource_uri for resource in resources])
+        self.child.records = records
+        return super().to_representation(resources)
+
+
 class MBResourceRelationSerializer(serializers.ModelSerializer):
     samsoek = serializers.SerializerMethodField()
+    records = None
 
     def get_samsoek(self, obj):
-        res = {'images': [], 'name': '', 'main_thumb': ''}
-        parts = obj.resource_uri.split('/')
-        id = parts.pop()
-        json_uri = '/'.join(parts) + '/jsonld/' + id
-        response = requests.get(json_uri, timeout=10)
-        try:
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            return print("Error: " + str(e))
-
-        json_obj = response.json()
-        for item in json_obj['@graph']:
-            if item['@type'] == 'Image':
-                res['images'].append({'filename': item['lowresSource'], 'thumbnail': item['thumbnailSource']})
-            elif item['@type'] == 'ItemName':
-                if 'name' in item:
-                    res['name'] = item['name'].title()
-            elif item['@type'] == 'Entity':
-                res['main_thumb'] = item['thumbnail']
-        # find higher resolution version
-        for image in res['images']:
-            if image['thumbnail'] == res['main_thumb']:
-                res['main_thumb'] = image['filename']
-        res['images'] = sorted(res['images'], key=lambda d: d['filename'])
-        return res
+        if self.records is None or obj.resource_uri not in self.records:
+            self.records = samsoek.get_resources([obj.resource_uri])
+        if self.records[obj.resource_uri] is None:
+            skip_response_cache(self.context)
+        return self.records[obj.resource_uri]
 
     class Meta:
         model = RelationMBResource
         fields = ['resource_uri', 'samsoek']
+        list_serializer_class = MBResourceListSerializer
 
 
 class PlaceTypeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = PlaceType
-        exclude = ['updated', 'aat']
+        exclude = ['updated', 'aat', 'lineage']
 
 
 class PlaceTypeMiniSerializer(serializers.ModelSerializer):
@@ -164,7 +197,7 @@ class QuoteMiniSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Quote
-        exclude = ['created', 'modified', 'notes', 'updated']
+        exclude = ['created', 'modified', 'notes', 'updated', 'search_document', 'search_vector']
 
 
 class SourceMiniSerializer(serializers.ModelSerializer):
@@ -205,8 +238,22 @@ class PlaceMiniSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'municipality', 'parish', 'place_type', 'geometry']
 
 
+class PlaceMapListSerializer(GeoFeatureModelListSerializer):
+    """ Let the child work out its counts for the whole page at once
+    """
+
+    def to_representation(self, data):
+        places = list(data.all() if isinstance(data, Manager) else data)
+        self.child.page_counts = self.child.get_page_counts([place.id for place in places])
+        return super().to_representation(places)
+
+
 class PlaceMapSerializer(GeoFeatureModelSerializer):
     place_type = PlaceTypeMiniSerializer(read_only=True)
+    page_counts = None
+
+    def get_page_counts(self, place_ids):
+        return None
 
     # flatten for easier access for frontend
     def to_representation(self, instance):
@@ -230,13 +277,14 @@ class PlaceMapSerializer(GeoFeatureModelSerializer):
         model = Place
         fields = ['id', 'name', 'place_type', 'geometry']
         geo_field = 'geometry'
+        list_serializer_class = PlaceMapListSerializer
 
 
 class CultTypeMiniSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CultType
-        exclude = ['updated', 'aat', 'wikidata']
+        exclude = ['updated', 'aat', 'wikidata', 'lineage']
 
 
 class CultTypeSerializer(serializers.ModelSerializer):
@@ -244,19 +292,47 @@ class CultTypeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CultType
-        fields = '__all__'
+        exclude = ['lineage']
+
+
+def load_additional(context, iconographics):
+    """ Load the other images on the same cards as the given iconographic
+    rows into the serializer context, with one query for all cards not
+    loaded yet
+    """
+    additional = context.setdefault('additional', {})
+    missing = {(obj.card, obj.volume) for obj in iconographics} - additional.keys()
+    if missing:
+        for key in missing:
+            additional[key] = []
+        rows = Iconographic.objects.filter(volume__in={volume for card, volume in missing},
+                                           card__in={card for card, volume in missing})
+        for row in rows.values('id', 'motif2', 'filename', 'uri', 'card', 'volume'):
+            key = (row.pop('card'), row.pop('volume'))
+            if key in missing:
+                additional[key].append(row)
+    return additional
+
+
+class IconicListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        iconographics = list(data.all() if isinstance(data, Manager) else data)
+        load_additional(self.context, iconographics)
+        return super().to_representation(iconographics)
 
 
 class IconicMiniSerializer(serializers.ModelSerializer):
     additional = serializers.SerializerMethodField()
 
     def get_additional(self, obj):
-        additional = Iconographic.objects.all().filter(card=obj.card, volume=obj.volume).exclude(id=obj.id).values('id', 'motif2', 'filename', 'uri')
-        return additional
+        additional = load_additional(self.context, [obj])[(obj.card, obj.volume)]
+        return [row for row in additional if row['id'] != obj.id]
 
     class Meta:
         model = Iconographic
         fields = ['id', 'motif2', 'filename', 'uri', 'additional']
+        list_serializer_class = IconicListSerializer
 
 
 class CultRelationSerializer(serializers.ModelSerializer):
@@ -311,6 +387,16 @@ class CultMiniPlaceSerializer(CultMiniSerializer):
         fields = ['id', 'place', 'cult_type', 'relation_cult_agent', 'minyear', 'maxyear', 'place_uncertainty']
 
 
+class CultListSerializer(serializers.ListSerializer):
+    """ Load the additional iconographic cards of all cults at once
+    """
+
+    def to_representation(self, data):
+        cults = list(data.all() if isinstance(data, Manager) else data)
+        load_additional(self.context, [obj for cult in cults for obj in cult.relation_iconographic.all()])
+        return super().to_representation(cults)
+
+
 class CultSerializer(serializers.ModelSerializer):
     created = UserSerializer(read_only=True)
     modified = UserSerializer(read_only=True)
@@ -328,12 +414,13 @@ class CultSerializer(serializers.ModelSerializer):
     relation_iconographic = IconicMiniSerializer(read_only=True, many=True)
 
     def get_relation_cult_agent(self, obj):
-        relations = obj.relationcultagent_set.all().order_by('agent_alternative')
+        relations = related_ordered(obj.relationcultagent_set, 'agent_alternative')
         return AgentRelationSerializer(relations, read_only=True, many=True).data
 
     class Meta:
         model = Cult
-        exclude = ['notes']
+        exclude = ['notes', 'search_document', 'search_vector', 'years']
+        list_serializer_class = CultListSerializer
 
 
 class CultAgentRelationSerializer(serializers.ModelSerializer):
@@ -402,11 +489,11 @@ class AgentSerializer(serializers.ModelSerializer):
     relation_other_agent = RelationOtherCultSerializer(read_only=True, many=True, source='relationotheragent_set')
 
     def get_agent_names(self, obj):
-        return obj.agentname_set.values('name', 'language', 'not_before')
+        return related_values(obj.agentname_set, 'name', 'language', 'not_before')
 
     class Meta:
         model = Agent
-        exclude = ['notes']
+        exclude = ['notes', 'search_document', 'search_vector']
 
 
 class PlaceChildrenSerializer(serializers.ModelSerializer):
@@ -446,177 +533,70 @@ class PlaceSerializer(serializers.ModelSerializer):
     place_names = serializers.SerializerMethodField()
 
     def get_place_names(self, obj):
-        return obj.placename_set.all().values('name', 'language', 'not_before')
+        return related_values(obj.placename_set, 'name', 'language', 'not_before')
 
     class Meta:
         model = Place
-        exclude = ['notes']
+        exclude = ['notes', 'search_document', 'search_vector']
 
 
-class CultMapSerializer(PlaceMapSerializer):
+class PlaceCountsMapSerializer(PlaceMapSerializer):
+    """ Map features with counts per place, looked up from the counts
+    computed for the whole page by get_page_counts
+    """
     ids = serializers.SerializerMethodField()
 
     def get_ids(self, obj):
-        type = self.context['request'].query_params.get('ids')
-        range = self.context['request'].query_params.get('range')
-        res = {}
-        if type is not None and type != 'null':
-            types = type.split(',')
-            ids = obj.relation_cult_place.all().filter(Q(cult_type__in=types)
-                                                       | Q(cult_type__parent__in=types)
-                                                       | Q(cult_type__parent__parent__in=types))
-            if range is not None and range != '':
-                years = range.split(',')
-                minyear = int(years[0])
-                maxyear = int(years[1])
-                ids = ids.filter(minyear__lte=maxyear, maxyear__gte=minyear)
-            ids = ids.values('id', 'cult_type', 'cult_type__parent', 'cult_type__parent__parent')
-            for type in types:
-                res[type] = 0
-            for id in ids:
-                cult_type = str(id['cult_type'])
-                parent_type = str(id['cult_type__parent'])
-                parentp_type = str(id['cult_type__parent__parent'])
-                if cult_type != '' and cult_type in res:
-                    res[cult_type] += 1
-                if parent_type != '' and parent_type in res:
-                    res[parent_type] += 1
-                if parentp_type != '' and parentp_type in res:
-                    res[parentp_type] += 1
-            # for type in types:
-            #    res[type] = len(list((filter(lambda x: x["cult_type"] == int(type) or x["cult_type__parent"] or x["cult_type__parent__parent"] == int(type), ids))))
-        else:
-            if range is not None and range != '':
-                years = range.split(',')
-                minyear = int(years[0])
-                maxyear = int(years[1])
-                ids = obj.relation_cult_place.filter(minyear__lte=maxyear, maxyear__gte=minyear).values('id', 'cult_type')
-            else:
-                ids = obj.relation_cult_place.all().values('id', 'cult_type')
-            for id in ids:
-                cult_type = id['cult_type']
-                if cult_type in res:
-                    res[cult_type] += 1
-                elif cult_type is not None:
-                    res[cult_type] = 1
-        return res
+        if self.page_counts is None:
+            self.page_counts = self.get_page_counts([obj.id])
+        return self.page_counts[obj.id]
 
     class Meta:
         model = Place
         fields = ['id', 'name', 'place_type', 'ids', 'geometry']
         geo_field = 'geometry'
+        list_serializer_class = PlaceMapListSerializer
 
 
-class AdvancedCultMapSerializer(PlaceMapSerializer):
-    ids = serializers.SerializerMethodField()
+class CultMapSerializer(PlaceCountsMapSerializer):
 
-    def get_ids(self, obj):
-        res = {}
-        type = self.context['request'].query_params.get('type')
-        agent_type = self.context['request'].query_params.get('agent_type')
-        agent = self.context['request'].query_params.get('agent')
-        ids_rel = obj.relation_cult_place.only("cult_type", "relation_cult_agent", "relationotheragent_set")
-        ids_other = obj.relation_other_place.only("cult_type", "relation_cult_agent", "relationotheragent_set")
-        if type is not None and type != '':
+    def get_page_counts(self, place_ids):
+        type = self.context['request'].query_params.get('ids')
+        range = self.context['request'].query_params.get('range')
+        types = None
+        years = None
+        if type is not None and type != 'null':
             types = type.split(',')
-            ids_rel = ids_rel.prefetch_related('cult_type', 'cult_type__parent', 'cult_type__parent__parent').filter(Q(cult_type__in=types)
-                                     | Q(cult_type__parent__in=types)
-                                     | Q(cult_type__parent__parent__in=types)).distinct()
-            ids_other = ids_other.prefetch_related('cult_type', 'cult_type__parent', 'cult_type__parent__parent').filter(Q(cult_type__in=types)
-                                         | Q(cult_type__parent__in=types)
-                                         | Q(cult_type__parent__parent__in=types)).distinct()
-        if agent_type is not None and agent_type != '':
-            agent_types = agent_type.split(',')
-            ids_rel = ids_rel.prefetch_related('relation_cult_agent__agent_type',
-                                               'relationotheragent_set__agent__agent_type').filter(Q(relation_cult_agent__agent_type__in=agent_types)
-                                                                                                   | Q(relationotheragent__agent__agent_type__in=agent_types)).distinct()
-            ids_other = ids_other.prefetch_related('relation_cult_agent__agent_type',
-                                               'relationotheragent_set__agent__agent_type').filter(Q(relation_cult_agent__agent_type__in=agent_types)
-                                         | Q(relationotheragent__agent__agent_type__in=agent_types)).distinct()
-        if agent is not None and agent != '':
-            agents = agent.split(',')
-            ids_rel = ids_rel.prefetch_related('relation_cult_agent',
-                                               'relationotheragent_set__agent').filter(Q(relation_cult_agent__in=agents)
-                                                                                       | Q(relationotheragent__agent__in=agents)).distinct()
-            ids_other = ids_other.prefetch_related('relation_cult_agent',
-                                                   'relationotheragent_set__agent').filter(Q(relation_cult_agent__in=agents)
-                                                                                           | Q(relationotheragent__agent__in=agents)).distinct()
-
-        ids = ids_rel.union(ids_other)
-        ids = ids.values('cult_type')
-        for id in ids:
-            cult = id['cult_type']
-            if cult in res:
-                res[cult] += 1
-            elif cult is not None:
-                res[cult] = 1
-        return res
+        if range is not None and range != '':
+            years = [int(year) for year in range.split(',')[:2]]
+        return cult_type_counts(place_ids, types, years)
 
-    class Meta:
-        model = Place
-        fields = ['id', 'name', 'place_type', 'ids', 'geometry']
-        geo_field = 'geometry'
 
+class AdvancedCultMapSerializer(PlaceCountsMapSerializer):
 
-class SaintsMapSerializer(PlaceMapSerializer):
-    ids = serializers.SerializerMethodField()
+    def get_page_counts(self, place_ids):
+        cults = self.context.get('cults', Cult.objects.all())
+        return place_cult_type_counts(place_ids, cults)
 
-    def get_ids(self, obj):
+
+class AgentMapSerializer(PlaceCountsMapSerializer):
+    relation = None
+
+    def get_page_counts(self, place_ids):
         type = self.context['request'].query_params.get('ids')
         agent = self.context['request'].query_params.get('agent')
-        res = {}
+        types = None
+        agents = None
         if type is not None and type != 'null':
             types = type.split(',')
-            ids = obj.relation_cult_place.filter(relationcultagent__agent__agent_type__in=types).values('relationcultagent__agent__agent_type')
         elif type is None and agent is not None:
             agents = agent.split(',')
-            ids = obj.relation_cult_place.filter(relationcultagent__agent_id__in=agents).values('relationcultagent__agent_id')
-        else:
-            ids = obj.relation_cult_place.all().values('relationcultagent__agent__agent_type')        
-        for id in ids:
-            if agent is not None:
-                agent_id = id['relationcultagent__agent_id']
-            else:
-                agent_id = id['relationcultagent__agent__agent_type']
-            if agent_id in res:
-                res[agent_id] += 1
-            elif agent_id is not None:
-                res[agent_id] = 1
-        return res
+        return agent_counts(self.relation, place_ids, types, agents)
 
-    class Meta:
-        model = Place
-        fields = ['id', 'name', 'place_type', 'ids', 'geometry']
-        geo_field = 'geometry'
 
+class SaintsMapSerializer(AgentMapSerializer):
+    relation = "saint"
 
-class PeopleMapSerializer(PlaceMapSerializer):
-    ids = serializers.SerializerMethodField()
-
-    def get_ids(self, obj):
-        type = self.context['request'].query_params.get('ids')
-        agent = self.context['request'].query_params.get('agent')
-        res = {}
-        if type is not None and type != 'null':
-            types = type.split(',')
-            ids = obj.relation_cult_place.filter(relationotheragent__agent__agent_type__in=types).values('relationotheragent__agent__agent_type')
-        elif type is None and agent is not None:
-            agents = agent.split(',')
-            ids = obj.relation_cult_place.filter(relationotheragent__agent_id__in=agents).values('relationotheragent__agent_id')
-        else:
-            ids = obj.relation_cult_place.all().values('relationotheragent__agent__agent_type')
-        for id in ids:
-            if agent is not None:
-                agent_id = id['relationotheragent__agent_id']
-            else:
-                agent_id = id['relationotheragent__agent__agent_type']
-            if agent_id in res:
-                res[agent_id] += 1
-            elif agent_id is not None:
-                res[agent_id] = 1
-        return res
 
-    class Meta:
-        model = Place
-        fields = ['id', 'name', 'place_type', 'ids', 'geometry']
-        geo_field = 'geometry'
+class PeopleMapSerializer(AgentMapSerializer):
+    relation = "people"
@@ -0,0 +1,95 @@
+from django.apps import apps
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .cache import bump_data_version, bump_on_commit
+from .models import Agent, Cult, CultType, MapSummary, PlaceType, RelationCultAgent, RelationOtherAgent, \
+    RelationOtherPlace
+from .search import SOURCES, get_dependent_documents, update_documents
+from .summary import update_map_summary
+
+# Receivers are connected per sender: a post_delete receiver for any sender
+# turns off fast deletes of every model, and the summary is rewritten with
+# bulk deletes. MapSummary is derived data, the changes it is built from
+# already change the data version.
+SUMMARY_SOURCES = (Cult, CultType, RelationCultAgent, RelationOtherAgent, RelationOtherPlace)
+EXPLORE_MODELS = [model for model in apps.get_app_config("explore").get_models() if model is not MapSummary]
+
+
+def is_explore_model(sender):
+    return sender._meta.app_label == "explore"
+
+
+def get_agent_cults(agents):
+    return RelationCultAgent.objects.filter(agent__in=agents).values_list("cult_id", flat=True).union(
+        RelationOtherAgent.objects.filter(agent__in=agents).values_list("cult_id", flat=True))
+
+
+def connect(receiver, senders):
+    for sender in senders:
+        post_save.connect(receiver, sender=sender)
+        post_delete.connect(receiver, sender=sender)
+
+
+def update_lineage(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.update_lineage()
+
+
+# connected before update_summary, which reads the lineage of cult types
+post_save.connect(update_lineage, sender=CultType)
+post_save.connect(update_lineage, sender=PlaceType)
+
+
+# connected before data_changed, so that the summary is up to date once the
+# data version changes
+def update_summary(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if isinstance(instance, Cult):
+        update_map_summary([instance.pk])
+    elif isinstance(instance, (RelationCultAgent, RelationOtherAgent, RelationOtherPlace)):
+        update_map_summary([instance.cult_id])
+    elif isinstance(instance, CultType) and kwargs.get("signal") is post_save:
+        update_map_summary(Cult.objects.filter(cult_type__lineage__contains=[instance.pk]).values_list("id", flat=True))
+
+
+connect(update_summary, SUMMARY_SOURCES)
+
+
+@receiver(m2m_changed)
+def update_relation_summary(sender, instance, action, reverse, pk_set, **kwargs):
+    # pk_set holds the ids of the other side of the relation, it is None
+    # when clearing in which case reverse relations can't be followed
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if sender is Agent.agent_type.through:
+        agents = (pk_set or []) if reverse else [instance.pk]
+        update_map_summary(get_agent_cults(agents))
+    elif sender in (RelationCultAgent, RelationOtherPlace):
+        update_map_summary((pk_set or []) if reverse else [instance.pk])
+
+
+# the version changes once the transaction of the change is committed, so
+# that no response of the data before it is cached under the new version
+def data_changed(sender, **kwargs):
+    bump_on_commit(bump_data_version)
+
+
+connect(data_changed, EXPLORE_MODELS)
+
+
+@receiver(m2m_changed)
+def relation_changed(sender, action, **kwargs):
+    # sender is the through model of the many-to-many field
+    if is_explore_model(sender) and action in ("post_add", "post_remove", "post_clear"):
+        bump_on_commit(bump_data_version)
+
+
+def update_search_documents(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for model, ids in get_dependent_documents(instance):
+        update_documents(model, ids)
+
+
+connect(update_search_documents, SOURCES)
@@ -0,0 +1,48 @@
+from collections import defaultdict
+from django.db import transaction
+from .models import Cult, MapSummary, RelationCultAgent, RelationOtherAgent, RelationOtherPlace
+
+# The map layers read their filters and counts from MapSummary instead of
+# joining cults, agents and types on every request. Rows are rebuilt per cult
+# whenever anything they are derived from changes.
+
+
+def get_agents(relation, cult_ids):
+    ids = defaultdict(list)
+    types = defaultdict(list)
+    relations = relation.objects.filter(cult__in=cult_ids)
+    for cult_id, agent_id in relations.values_list("cult_id", "agent_id"):
+        ids[cult_id].append(agent_id)
+    for cult_id, agent_type in relations.values_list("cult_id", "agent__agent_type"):
+        if agent_type is not None:
+            types[cult_id].append(agent_type)
+    return ids, types
+
+
+def update_map_summary(cult_ids):
+    """ Rebuild the map summary rows of the given cults
+    """
+    cult_ids = list(cult_ids)
+    if not cult_ids:
+        return 0
+    saint_ids, saint_types = get_agents(RelationCultAgent, cult_ids)
+    people_ids, people_types = get_agents(RelationOtherAgent, cult_ids)
+    other_places = defaultdict(set)
+    for cult_id, place_id in RelationOtherPlace.objects.filter(cult__in=cult_ids).values_list("cult_id", "place_id"):
+        other_places[cult_id].add(place_id)
+    rows = []
+    cults = Cult.objects.filter(id__in=cult_ids).values_list(
+        "id", "place_id", "cult_type_id", "cult_type__lineage", "years")
+    for id, place_id, cult_type, lineage, years in cults:
+        places = (other_places[id] | {place_id}) - {None}
+        for place in places:
+            rows.append(MapSummary(
+                place_id=place, cult_id=id, own=place == place_id,
+                cult_type_id=cult_type, cult_types=lineage or [cult_type],
+                years=years,
+                saint_ids=saint_ids[id], saint_types=saint_types[id],
+                people_ids=people_ids[id], people_types=people_types[id]))
+    with transaction.atomic():
+        MapSummary.objects.filter(cult__in=cult_ids).delete()
+        MapSummary.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,208 @@
+import random
+from django.contrib.gis.geos import Point
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from .cache import bump_data_version
+from .models import Agent, AgentName, AgentType, Cult, CultType, FeastDay, \
+    Iconographic, Organization, OrganizationName, OrganizationType, Parish, \
+    Place, PlaceName, PlaceType, Quote, RelationCultAgent, \
+    RelationIconographic, RelationOtherAgent, RelationOtherPlace, \
+    RelationQuote, Source, parse_time_period, year_range
+from .search import DOCUMENTS, update_documents
+from .summary import update_map_summary
+
+# A deterministic synthetic dataset for benchmarks and tests. The same scale
+# and seed always give the same rows with the same ids. Type ids match the
+# ones the views refer to, e.g. diocese organization types 2 and 9 and place
+# types 1 to 6 as parents of the types shown at low zoom levels. Every kind of
+# relation exists at any scale, and place 1, cult 1, saint 1, person 3, quote 1
+# and source 1 have more relations the larger the scale is.
+MODELS = [
+    OrganizationType, Organization, OrganizationName, Parish, PlaceType,
+    CultType, AgentType, Place, PlaceName, Source, Quote, RelationQuote,
+    Agent, AgentName, FeastDay, Cult, RelationCultAgent, RelationOtherAgent,
+    RelationOtherPlace, Iconographic, RelationIconographic,
+]
+LANGUAGES = ["eng", "lat", "swe", "fin", "deu"]
+# lower left and upper right corner of the generated places
+EXTENT = (10.0, 55.0, 25.0, 69.0)
+
+
+def get_sizes(scale):
+    return {
+        "places": scale,
+        "parishes": max(scale // 10, 1),
+        "organizations": max(scale // 2, 2),
+        "agents": max(scale // 2, 3),
+        "cults": scale * 3,
+        "sources": max(scale // 20, 1),
+        "quotes": scale,
+        "iconographic": scale,
+    }
+
+
+def pick(rng, ids, k=1):
+    return rng.sample(ids, min(k, len(ids)))
+
+
+def hub(rng, id, every, size):
+    """ Relate every `every`th row to the row with id 1, so that the number
+    of relations of the first rows grows with the scale, and the others to
+    a random row
+    """
+    return 1 if id % every == 1 else rng.randint(1, size)
+
+
+def get_cult_place(rng, id, places):
+    # the child place 2 has cults at any scale too
+    if id % 4 == 2:
+        return 2
+    return hub(rng, id, 4, places)
+
+
+def get_time_period(rng):
+    start = rng.randint(1000, 1500)
+    end = start + rng.randint(0, 300)
+    return rng.choice([
+        "%d" % start,
+        "%d_%d" % (start, end),
+        "%d-%d_%d-%d" % (start, start + 10, end, end + 10),
+        "3-3_2-2",
+        "",
+    ])
+
+
+def create_types():
+    OrganizationType.objects.bulk_create([
+        OrganizationType(id=id, name="Organization type %d" % id) for id in range(1, 10)])
+    place_types = [PlaceType(id=id, name="Place type %d" % id, level="Place Type") for id in range(1, 7)]
+    place_types += [PlaceType(id=id, name="Place subcategory %d" % id, level="Subcategory", parent_id=(id - 7) % 6 + 1)
+                    for id in range(7, 67)]
+    place_types += [PlaceType(id=id, name="Cult place type %d" % id, level="Cult Place Type") for id in range(67, 71)]
+    PlaceType.objects.bulk_create(place_types)
+    cult_types = [CultType(id=id, name="Type of evidence %d" % id, level="Type of Evidence") for id in range(1, 5)]
+    cult_types += [CultType(id=id, name="Intermediate type %d" % id, level="Intermediate", parent_id=(id - 5) % 4 + 1)
+                   for id in range(5, 17)]
+    cult_types += [CultType(id=id, name="Cult type %d" % id, level="Subcategory", parent_id=(id - 17) % 12 + 5)
+                   for id in range(17, 65)]
+    CultType.objects.bulk_create(cult_types)
+    PlaceType.rebuild_lineage()
+    CultType.rebuild_lineage()
+    AgentType.objects.bulk_create(
+        [AgentType(id=id, name="Agent type %d" % id, level="Type of Agent") for id in range(1, 11)]
+        + [AgentType(id=id, name="Involvement %d" % id, level="Type of Involvement") for id in range(11, 16)])
+
+
+def generate(scale=100, seed=1):
+    """ Fill the explore models with a synthetic dataset of `scale` places and
+    proportionate numbers of everything else, and return the row counts
+    """
+    rng = random.Random(seed)
+    sizes = get_sizes(scale)
+    with transaction.atomic():
+        create_types()
+        subcategories = list(range(7, 67))
+        cult_subcategories = list(range(17, 65))
+
+        # medieval dioceses have odd, modern ones even ids
+        Organization.objects.bulk_create([
+            Organization(id=id, name="Diocese %d" % id, organization_type_id=2 if id % 2 else 9)
+            for id in range(1, sizes["organizations"] + 1)])
+        OrganizationName.objects.bulk_create([
+            OrganizationName(organization_id=id, name="Dioecesis %d" % id, language=rng.choice(LANGUAGES))
+            for id in range(1, sizes["organizations"] + 1)])
+        medieval = list(range(1, sizes["organizations"] + 1, 2))
+        modern = list(range(2, sizes["organizations"] + 1, 2))
+        Parish.objects.bulk_create([
+            Parish(id=id, name="Parish %d" % id, snid_4=id,
+                   organization_id=rng.choice(modern), medival_organization_id=rng.choice(medieval))
+            for id in range(1, sizes["parishes"] + 1)])
+
+        places = []
+        for id in range(1, sizes["places"] + 1):
+            places.append(Place(
+                id=id, name="Place %d" % id, place_type_id=rng.choice(subcategories),
+                parish_id=rng.randint(1, sizes["parishes"]),
+                parent_id=1 if id % 5 == 2 else None,
+                geometry=Point(rng.uniform(EXTENT[0], EXTENT[2]), rng.uniform(EXTENT[1], EXTENT[3]), srid=4326),
+                municipality="Municipality %d" % rng.randint(1, 50)))
+        Place.objects.bulk_create(places)
+        PlaceName.objects.bulk_create([
+            PlaceName(place_id=id, name="Locus %d" % id, language=rng.choice(LANGUAGES))
+            for id in range(1, sizes["places"] + 1)])
+
+        Source.objects.bulk_create([
+            Source(id=id, name="Source %d" % id, title="Title %d" % id, source_type=rng.choice(list(Source.SOURCE_TYPES)),
+                   author="Author %d" % id)
+            for id in range(1, sizes["sources"] + 1)])
+        Quote.objects.bulk_create([
+            Quote(id=id, source_id=hub(rng, id, 2, sizes["sources"]), page=str(rng.randint(1, 300)),
+                  language=rng.choice(LANGUAGES), quote_transcription="<p>Quote %d</p>" % id)
+            for id in range(1, sizes["quotes"] + 1)])
+        RelationQuote.objects.bulk_create([
+            RelationQuote(place_id=hub(rng, id, 2, sizes["places"]), quote_id=id)
+            for id in range(1, sizes["quotes"] + 1)])
+
+        agents = []
+        for id in range(1, sizes["agents"] + 1):
+            agents.append(Agent(id=id, name="Agent %d" % id, saint=id % 3 != 0,
+                                gender=rng.choice(list(Agent.GENDER_TYPES))))
+        Agent.objects.bulk_create(agents)
+        saints = [agent.id for agent in agents if agent.saint]
+        people = [agent.id for agent in agents if not agent.saint]
+        Agent.agent_type.through.objects.bulk_create([
+            Agent.agent_type.through(agent_id=agent.id, agenttype_id=type)
+            for agent in agents for type in pick(rng, list(range(1, 11)), rng.randint(1, 2))])
+        AgentName.objects.bulk_create([
+            AgentName(agent_id=agent.id, name="Sanctus %d" % agent.id, language=rng.choice(LANGUAGES))
+            for agent in agents])
+        FeastDay.objects.bulk_create([
+            FeastDay(agent_id=id, day="%02d-%02d" % (rng.randint(1, 12), rng.randint(1, 28))) for id in saints])
+
+        cults = []
+        for id in range(1, sizes["cults"] + 1):
+            time_period = get_time_period(rng)
+            minyear, maxyear = parse_time_period(time_period)
+            cults.append(Cult(
+                id=id, place_id=get_cult_place(rng, id, sizes["places"]), cult_type_id=rng.choice(cult_subcategories),
+                time_period=time_period, minyear=minyear, maxyear=maxyear, years=year_range(minyear, maxyear),
+                extant=rng.choice(list(Cult.EXTANT_TYPES)), feast_day="%02d-%02d" % (rng.randint(1, 12), rng.randint(1, 28)),
+                parent_id=1 if id % 7 == 2 else None))
+        Cult.objects.bulk_create(cults)
+        Cult.quote.through.objects.bulk_create([
+            Cult.quote.through(cult_id=id, quote_id=hub(rng, id, 2, sizes["quotes"]))
+            for id in range(1, sizes["cults"] + 1) if id % 3 == 1])
+        # associated is symmetrical and stored in both directions
+        Cult.associated.through.objects.bulk_create([
+            Cult.associated.through(from_cult_id=from_id, to_cult_id=to_id)
+            for id in range(2, sizes["cults"] + 1) if id % 7 == 3 for from_id, to_id in [(1, id), (id, 1)]])
+        RelationCultAgent.objects.bulk_create([
+            RelationCultAgent(cult_id=id, agent_id=agent, agent_uncertainty=rng.random() < 0.1)
+            for id in range(1, sizes["cults"] + 1)
+            for agent in {1 if id % 3 == 1 else rng.choice(saints), rng.choice(saints)}])
+        RelationOtherAgent.objects.bulk_create([
+            RelationOtherAgent(cult_id=id, agent_id=3 if id % 2 else rng.choice(people), role_id=rng.randint(11, 15))
+            for id in range(1, sizes["cults"] + 1) if id % 3 == 1])
+        RelationOtherPlace.objects.bulk_create([
+            RelationOtherPlace(cult_id=id, place_id=2 if cult.place_id == 1 else 1, role_id=rng.randint(67, 70))
+            for id, cult in enumerate(cults, 1) if id % 5 == 1])
+
+        Iconographic.objects.bulk_create([
+            Iconographic(id=id, card=(id - 1) // 3 + 1, volume=1, card_type=rng.choice(list(Iconographic.CARD_TYPES)),
+                         filename="card%d.jpg" % id, front_back="f", description="Card %d" % id,
+                         filename2="card%d_2.jpg" % id, motif2="Motif %d" % id,
+                         place_id=rng.randint(1, sizes["places"]))
+            for id in range(1, sizes["iconographic"] + 1)])
+        RelationIconographic.objects.bulk_create([
+            RelationIconographic(cult_id=hub(rng, id, 2, sizes["cults"]), iconographic_id=id)
+            for id in range(1, sizes["iconographic"] + 1)])
+
+        # derived data the signals would otherwise keep up to date
+        for model in DOCUMENTS:
+            update_documents(model, model.objects.values_list("id", flat=True))
+        update_map_summary(Cult.objects.values_list("id", flat=True))
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), MODELS):
+                cursor.execute(sql)
+    bump_data_version()
+    return {model._meta.model_name: model.objects.count() for model in MODELS}
@@ -1,3 +1,252 @@
-from django.test import TestCase
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.deletion import Collector
+from django.test import SimpleTestCase, TestCase, override_settings
+from . import benchmark, samsoek, synthetic
+from .models import Cult, MapSummary, Quote, RelationMBResource
 
-# Create your tests here.
+# Upper bounds of the number of queries of the benchmark requests. Keys match
+# a request name, or the start of it followed by a space, and the longest key
+# wins, so "cult list mini" applies to the mini list, "cult detail mini" to
+# the mini detail and "cult" to the rest.
+QUERY_BUDGETS = {
+    "agents": 16,
+    "agents list mini": 3,
+    "agents detail mini": 3,
+    "saints": 16,
+    "saints list mini": 3,
+    "saints detail mini": 3,
+    "people": 16,
+    "people list mini": 3,
+    "people detail mini": 3,
+    "organization": 4,
+    "diocese": 2,
+    "cult": 32,
+    "cult list mini": 4,
+    "cult detail mini": 4,
+    "advanced": 8,
+    "place": 22,
+    "place list mini": 4,
+    "place detail mini": 4,
+    "placechildren": 12,
+    "source": 6,
+    "source list mini": 2,
+    "source detail mini": 2,
+    "quote": 8,
+    "quote list mini": 2,
+    "quote detail mini": 2,
+    "placetype": 2,
+    "culttype": 3,
+    "agenttype": 2,
+    "map": 4,
+    "map clusters": 1,
+    "advancedmap": 4,
+    "export": 8,
+}
+
+
+def get_budget(name):
+    keys = [key for key in QUERY_BUDGETS if name == key or name.startswith(key + " ")]
+    return QUERY_BUDGETS[max(keys, key=len)] if keys else None
+
+
+@override_settings(METRICS_SAMPLE_RATE=0, CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class QueryBudgetTest(TestCase):
+    """ Every request of the benchmark stays within its query budget, and
+    runs as many queries on a small dataset as on one four times as large
+    """
+    scales = (4, 16)
+
+    def count_queries(self, scale):
+        counts = {}
+        with transaction.atomic():
+            synthetic.generate(scale)
+            for name, path, params in benchmark.get_requests():
+                counts[name] = benchmark.measure(self.client, path, params, 1)
+            transaction.set_rollback(True)
+        return counts
+
+    def test_query_budgets(self):
+        small, large = [self.count_queries(scale) for scale in self.scales]
+        for name, result in large.items():
+            with self.subTest(name):
+                budget = get_budget(name)
+                self.assertIsNotNone(budget, "No query budget for %s" % name)
+                self.assertEqual(small[name]["status"], 200)
+                self.assertEqual(result["status"], 200)
+                self.assertEqual(small[name]["queries"], result["queries"],
+                                 "Number of queries grows with the data")
+                self.assertLessEqual(result["queries"], budget)
+
+
+@override_settings(METRICS_SAMPLE_RATE=0, CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class MapFilterTest(TestCase):
+    """ Filters of the map layers over relations of places give every place
+    once, however many of its cults match
+    """
+    # place 1 has a quarter of all cults
+    scale = 16
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic.generate(cls.scale)
+        # cults 1, 5 and 9 are at place 1
+        Cult.objects.filter(id__in=[1, 5, 9]).update(cult_uncertainty=True)
+
+    def assertDistinctPlaces(self, params):
+        response = self.client.get("/api/map/", dict(params, layer="cult"))
+        self.assertEqual(response.status_code, 200)
+        ids = [feature["id"] for feature in response.data["results"]["features"]]
+        self.assertTrue(ids)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(response.data["count"], len(ids))
+        return ids
+
+    def test_ids(self):
+        self.assertDistinctPlaces({"ids": "1,2,3,4", "extant": "Extant"})
+        self.assertDistinctPlaces({"ids": "1,2,3,4", "uncertainty": "false", "extant": "Extant"})
+
+    def test_search(self):
+        self.assertDistinctPlaces({"search": "Agent", "extant": "Extant"})
+        self.assertDistinctPlaces({"search": "Place", "uncertainty": "false"})
+        self.assertEqual(self.assertDistinctPlaces({"search": "Place", "uncertainty": "true"}), [1])
+
+
+@override_settings(METRICS_SAMPLE_RATE=0, CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class KeysetPaginationTest(TestCase):
+    """ Following the links of keyset pagination visits every row once, also
+    rows with a null or repeated value of the ordering field
+    """
+    scale = 16
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic.generate(cls.scale)
+        Cult.objects.filter(id__in=[2, 5, 30]).update(place=None)
+        Quote.objects.filter(id__in=[1, 7]).update(source=None)
+
+    def crawl(self, path, params, link):
+        response = self.client.get(path, dict(params, pagination="cursor"))
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [row["id"] for row in response.data["results"]]
+            if response.data[link] is None:
+                return ids
+            response = self.client.get(response.data[link])
+
+    def assertVisitsAll(self, path, model, params=None):
+        ids = self.crawl(path, params or {}, "next")
+        self.assertEqual(sorted(ids), list(model.objects.order_by("id").values_list("id", flat=True)))
+        # and back from the last page
+        response = self.client.get(path, dict(params or {}, pagination="cursor"))
+        while response.data["next"] is not None:
+            response = self.client.get(response.data["next"])
+        backward = [row["id"] for row in response.data["results"]]
+        while response.data["previous"] is not None:
+            response = self.client.get(response.data["previous"])
+            backward = [row["id"] for row in response.data["results"]] + backward
+        self.assertEqual(backward, ids)
+
+    def test_nullable_ordering(self):
+        self.assertVisitsAll("/api/cult/", Cult)
+        self.assertVisitsAll("/api/cult/", Cult, {"ordering": "-place__name"})
+        self.assertVisitsAll("/api/cult/", Cult, {"mini": "true"})
+        self.assertVisitsAll("/api/quote/", Quote)
+
+    def test_page_size(self):
+        response = self.client.get("/api/cult/", {"pagination": "cursor", "page_size": "10"})
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertVisitsAll("/api/cult/", Cult, {"page_size": "10"})
+
+
+class SamsoekStub(BaseHTTPRequestHandler):
+    """ Answers /<path>/jsonld/<id> like K-samsök, and 404 for ids starting
+    with "missing"
+    """
+
+    def do_GET(self):
+        id = self.path.rsplit("/", 1)[-1]
+        if id.startswith("missing"):
+            self.send_error(404)
+            return
+        body = json.dumps({"@graph": [
+            {"@type": "ItemName", "name": "object %s" % id},
+            {"@type": "Entity", "thumbnail": "thumb%s.jpg" % id},
+            {"@type": "Image", "lowresSource": "image%s.jpg" % id, "thumbnailSource": "thumb%s.jpg" % id},
+        ]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(METRICS_SAMPLE_RATE=0, CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "samsoek"}})
+class SamsoekTest(TestCase):
+    """ K-samsök records missing from the cache are given as None without
+    waiting for K-samsök, and served once fetched in the background
+    """
+    uri = "https://kulturarvsdata.se/shm/object/1"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), SamsoekStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.enterClassContext(override_settings(SAMSOEK_URL="http://127.0.0.1:%d" % cls.server.server_port))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def wait_for(self, uri):
+        future = samsoek.pending.get(uri)
+        if future is not None:
+            future.result(timeout=5)
+
+    def test_get_resources(self):
+        missing = "https://kulturarvsdata.se/shm/object/missing1"
+        self.assertEqual(samsoek.get_resources([self.uri, missing]), {self.uri: None, missing: None})
+        self.wait_for(self.uri)
+        self.wait_for(missing)
+        self.assertEqual(samsoek.get_resources([self.uri, missing]), {
+            self.uri: {"images": [{"filename": "image1.jpg", "thumbnail": "thumb1.jpg"}],
+                       "name": "Object 1", "main_thumb": "image1.jpg"},
+            # failures are cached too
+            missing: None,
+        })
+
+    def test_cult_detail(self):
+        synthetic.generate(4)
+        RelationMBResource.objects.create(cult_id=1, resource_uri=self.uri)
+        response = self.client.get("/api/cult/1/")
+        self.assertEqual(response.data["relation_mb_resource"][0]["samsoek"], None)
+        self.assertNotIn("ETag", response)
+        self.wait_for(self.uri)
+        # the response without the record was not cached
+        response = self.client.get("/api/cult/1/")
+        self.assertEqual(response.data["relation_mb_resource"][0]["samsoek"]["name"], "Object 1")
+
+
+class SignalsTest(SimpleTestCase):
+    """ Rebuilding the map summary deletes its rows with a single query
+    """
+
+    def test_summary_fast_delete(self):
+        self.assertTrue(Collector(using="default").can_fast_delete(MapSummary.objects.all()))
@@ -1,6 +1,6 @@
 from django.urls import include, path
 from rest_framework import routers
-from . import views
+from . import async_views, views
 
 router = routers.DefaultRouter()
 router.register("saints", views.SaintsViewSet, basename="saints")
@@ -19,8 +19,13 @@ router.register("culttype", views.CultTypesViewSet, basename="culttype")
 router.register("placetype", views.PlaceTypesViewSet, basename="placetype")
 router.register("map", views.MapViewSet, basename="map")
 router.register("advancedmap", views.AdvancedMapViewSet, basename="advancedmap")
+router.register("export", views.ExportViewSet, basename="export")
+router.register("metrics", views.MetricsViewSet, basename="metrics")
 
 urlpatterns = [
+    path("async/map/", async_views.map_list),
+    path("async/cult/<int:pk>/", async_views.cult_detail),
+    path("async/<str:basename>/", async_views.search),
     path("", include(router.urls)),
     # path("api-auth/", include("rest_framework.urls", namespace='rest_framework')),
 ]
@@ -1,10 +1,29 @@
-from rest_framework import viewsets, filters, pagination
+import json
+import os
+from rest_framework import viewsets, filters, pagination, permissions
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 from rest_framework_gis.filters import InBBoxFilter
 # from rest_framework_gis.pagination import GeoJsonPagination
+from django.conf import settings
 from django.contrib.gis.gdal.envelope import Envelope
-from django.db.models import Q
+from django.contrib.gis.db.models import Collect
+from django.contrib.gis.db.models.functions import Centroid, SnapToGrid
+from django.db.models import F, Q, Count, Min, Prefetch
+from django.http import StreamingHttpResponse
 from . import models
+from .models import year_range
+from .cache import CachedResponseMixin
+from .columnar import ColumnarRenderer, get_columns, get_place_rows
+from .export import FORMATS, export
+from .filters import DocumentSearchFilter
+from .instrumentation import IsInternal, get_pool_stats, get_stats
+from .rows import RowSerializer, AgentMiniRowSerializer, \
+    AgentTypeRowSerializer, CultMiniRowSerializer, CultTypeRowSerializer, \
+    OrganizationMiniRowSerializer, PlaceMiniRowSerializer, \
+    PlaceTypeRowSerializer, QuoteMiniRowSerializer
 from .serializers import AgentSerializer, CultSerializer, PlaceSerializer, \
     AgentTypeSerializer, PlaceTypeSerializer, CultTypeSerializer, \
     SourceSerializer, OrganizationSerializer, PlaceMiniSerializer, \
@@ -25,12 +44,202 @@ class LargeResultsSetPagination(pagination.PageNumberPagination):
     max_page_size = 200
 
 
-class OrderingMixin(viewsets.ReadOnlyModelViewSet):
+def get_keyset_filter(fields, position):
+    """
+    Return a filter for the rows after `position` in the order of `fields`,
+    (lookup, descending) pairs ordered with nulls last when ascending and
+    first when descending, as PostgreSQL does by default.
+    """
+    (field, descending), value = fields[0], position[0]
+    if value is None:
+        after = Q(**{field + '__isnull': False}) if descending else Q(pk__in=[])
+        same = Q(**{field + '__isnull': True})
+    else:
+        after = Q(**{field + '__lt': value}) if descending else Q(**{field + '__gt': value}) | Q(**{field + '__isnull': True})
+        same = Q(**{field: value})
+    if len(fields) == 1:
+        return after
+    return after | (same & get_keyset_filter(fields[1:], position[1:]))
+
+
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Select pages by the position of the last row instead of an offset, so
+    that every page costs the same. Positions hold the value of every
+    ordering field, ending with the id, so that rows with the same or a
+    null value are neither skipped nor repeated. The exact count is left
+    out unless requested with `count=true`.
+    """
+    ordering = ['id']
+    page_size_query_param = 'page_size'
+    count = None
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if 'id' not in ordering and '-id' not in ordering:
+            ordering += ('id',)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get('count') == 'true':
+            self.count = queryset.count()
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.get_cursor_position()
+
+        # pages before the cursor are read in the opposite order
+        fields = [(field.lstrip('-'), field.startswith('-') != reverse) for field in self.ordering]
+        queryset = queryset.order_by(*[F(field).desc(nulls_first=True) if descending else F(field).asc(nulls_last=True)
+                                       for field, descending in fields])
+        if position is not None:
+            queryset = queryset.filter(get_keyset_filter(fields, position))
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_cursor_position(self):
+        if self.cursor is None or self.cursor.position is None:
+            return None
+        try:
+            position = json.loads(self.cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_link(self, instance, reverse):
+        if instance is not None:
+            position = json.dumps(self.get_position(instance), default=str)
+        else:
+            # an empty page, continue from where it was asked for
+            position = self.cursor.position
+        return self.encode_cursor(pagination.Cursor(offset=0, reverse=reverse, position=position))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.get_link(self.page[-1] if self.page else None, False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.get_link(self.page[0] if self.page else None, True)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
+
+    def get_position(self, instance):
+        # follow related fields such as place__name
+        position = []
+        for field in self.ordering:
+            field = field.lstrip('-')
+            if isinstance(instance, dict) and field in instance:
+                # rows of values()
+                position.append(instance[field])
+                continue
+            value = instance
+            for attr in field.split('__'):
+                value = value[attr] if isinstance(value, dict) else getattr(value, attr)
+                if value is None:
+                    break
+            position.append(value)
+        return position
+
+
+class KeysetPaginationMixin:
+    """
+    Opt in to keyset pagination with `pagination=cursor`, keeping the page
+    size and ordering of the endpoint. Smaller pages can be asked for with
+    `page_size`, and larger ones up to the max_page_size of the endpoint.
+    """
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            paginator = super().paginator
+            if paginator is not None and self.request.query_params.get('pagination') == 'cursor':
+                keyset = KeysetPagination()
+                keyset.page_size = paginator.page_size
+                keyset.max_page_size = paginator.max_page_size or paginator.page_size
+                if paginator.page_size_query_param:
+                    keyset.page_size_query_param = paginator.page_size_query_param
+                paginator = keyset
+            self._paginator = paginator
+        return self._paginator
+
+
+# number of cluster grid cells along the edge of a web map tile
+CLUSTER_GRID_SIZE = 8
+
+
+class ColumnarMapMixin:
+    """
+    Serve a page of the map as columns built straight from the place rows
+    with `format=columns`, see explore.columnar.
+    """
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarRenderer]
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != ColumnarRenderer.format:
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(self.get_columns, request)
+
+    def get_columns(self, request):
+        rows = self.paginate_queryset(get_place_rows(self.filter_queryset(self.get_queryset())))
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        return self.get_paginated_response(get_columns(rows, serializer.get_page_counts))
+
+
+class RowSerializerMixin:
+    """
+    Turn the queryset into rows of values() when get_serializer_class gives
+    a RowSerializer, see explore.rows.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if issubclass(serializer_class, RowSerializer):
+            # keyset pagination reads the position from the ordering fields
+            ordering = [field for field in getattr(self, 'ordering_fields', None) or [] if field != '__all__']
+            return serializer_class.prepare(queryset, 'id', *ordering)
+        return queryset
+
+
+class OrderingMixin(CachedResponseMixin, KeysetPaginationMixin, RowSerializerMixin, viewsets.ReadOnlyModelViewSet):
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     ordering_fields = ['name']
     ordering = ['name']
 
 
+def cult_mini_prefetch(lookup):
+    """ Prefetch the cults at `lookup` with the relations CultMiniSerializer
+    shows
+    """
+    queryset = models.Cult.objects.select_related("place", "cult_type").prefetch_related("relationcultagent_set__agent")
+    return Prefetch(lookup, queryset=queryset)
+
+
 # Create your views here.
 # ViewSets define the view behavior.
 class AgentsViewSet(OrderingMixin):
@@ -45,7 +254,7 @@ class AgentsViewSet(OrderingMixin):
             queryset = queryset.prefetch_related("agentname_set", "relationcultagent_set__cult__cult_type", "relationcultagent_set__cult__place", "feastday_set")
             queryset = queryset.select_related("created", "modified")
             queryset = queryset.prefetch_related("relationoffice_set__organization", "relationoffice_set__role")
-            queryset = queryset.prefetch_related("relationotheragent_set__role", "relationotheragent_set__cult__cult_type", "relationotheragent_set__cult__place", "relationotheragent_set__cult__relationcultagent_set")
+            queryset = queryset.prefetch_related("relationotheragent_set__role", cult_mini_prefetch("relationotheragent_set__cult"))
         if gender is not None and gender != '' and gender != 'all':
             queryset = queryset.filter(gender=gender).order_by('name')
         if agent_type is not None:
@@ -62,7 +271,7 @@ class AgentsViewSet(OrderingMixin):
     def get_serializer_class(self):
         mini = self.request.query_params.get('mini')
         if mini is not None:
-            return AgentMiniSerializer
+            return AgentMiniRowSerializer if self.action == 'list' else AgentMiniSerializer
         else:
             return AgentSerializer
 
@@ -72,8 +281,8 @@ class AgentsViewSet(OrderingMixin):
             return LargeResultsSetPagination
         return api_settings.DEFAULT_PAGINATION_CLASS
 
+    filter_backends = [DocumentSearchFilter, filters.OrderingFilter]
     pagination_class = property(fget=get_pagination_class)
-    search_fields = ['name', 'agentname__name', 'feastday__day']
 
 
 class SaintsViewSet(AgentsViewSet):
@@ -93,7 +302,7 @@ class PeopleViewSet(AgentsViewSet):
 class OrganizationViewSet(OrderingMixin):
     queryset = models.Organization.objects.select_related("organization_type").prefetch_related("organizationname_set").all()
     serializer_class = OrganizationSerializer
-    search_fields = ['name']
+    filter_backends = [DocumentSearchFilter, filters.OrderingFilter]
 
 
 class AgentNamesViewSet(OrderingMixin):
@@ -119,10 +328,14 @@ class DiocesesViewSet(OrderingMixin):
         return queryset
 
     serializer_class = OrganizationMiniSerializer
+
+    def get_serializer_class(self):
+        return OrganizationMiniRowSerializer if self.action == 'list' else OrganizationMiniSerializer
+
     pagination_class = LargeResultsSetPagination
 
 
-class CultsViewSet(viewsets.ReadOnlyModelViewSet):
+class CultsViewSet(CachedResponseMixin, KeysetPaginationMixin, RowSerializerMixin, viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         options = self.request.query_params
         cult_type = options.get('type')
@@ -136,7 +349,10 @@ class CultsViewSet(viewsets.ReadOnlyModelViewSet):
         queryset = models.Cult.objects.select_related("cult_type", "cult_type__parent", "place", "created", "modified").all()
         queryset = queryset.prefetch_related("relationcultagent_set__agent")
         if mini is None:
-            queryset = queryset.prefetch_related("place__parish__medival_organization", "place__place_type", "cult_children", "quote", "associated", "relationotheragent_set__agent")
+            queryset = queryset.prefetch_related("place__parish__medival_organization", "place__place_type", "quote", "relationotheragent_set__agent", "relation_iconographic")
+            queryset = queryset.prefetch_related(cult_mini_prefetch("parent"), cult_mini_prefetch("associated"), cult_mini_prefetch("cult_children"))
+            queryset = queryset.prefetch_related("relationotheragent_set__role", "relationotherplace_set__role", "relationotherplace_set__place__place_type", "relationotherplace_set__place__parish__medival_organization")
+            queryset = queryset.prefetch_related("relationdigitalresource_set", "relationmbresource_set")
         if med_diocese is not None and med_diocese != '':
             if mini is not None:
                 queryset = queryset.prefetch_related("place__parish")
@@ -154,16 +370,16 @@ class CultsViewSet(viewsets.ReadOnlyModelViewSet):
             years = range.split(',')
             minyear = int(years[0])
             maxyear = int(years[1])
-            queryset = queryset.filter(minyear__lte=maxyear, maxyear__gte=minyear)
+            queryset = queryset.filter(years__overlap=year_range(minyear, maxyear))
         if cult_type is not None:
             types = cult_type.split(',')
-            queryset = queryset.filter(Q(cult_type__in=types) | Q(cult_type__parent__in=types) | Q(cult_type__parent__parent__in=types))
+            queryset = queryset.filter(cult_type__lineage__overlap=types)
         return queryset.order_by('place__name')
 
     def get_serializer_class(self):
         mini = self.request.query_params.get('mini')
         if mini is not None:
-            return CultMiniSerializer
+            return CultMiniRowSerializer if self.action == 'list' else CultMiniSerializer
         else:
             return CultSerializer
 
@@ -173,14 +389,13 @@ class CultsViewSet(viewsets.ReadOnlyModelViewSet):
             return LargeResultsSetPagination
         return api_settings.DEFAULT_PAGINATION_CLASS
 
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DocumentSearchFilter, filters.OrderingFilter]
     pagination_class = property(fget=get_pagination_class)
-    search_fields = ['place__name', 'cult_type__name', 'relation_cult_agent__name', 'relationotheragent__agent__name', 'feast_day']
     ordering_fields = ['place__name', 'cult_type__name']
     ordering = ['place__name']
 
 
-class CultAdvancedViewSet(viewsets.ReadOnlyModelViewSet):
+class CultAdvancedViewSet(CachedResponseMixin, KeysetPaginationMixin, RowSerializerMixin, viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         options = self.request.query_params
         cult_type = options.get('type')
@@ -189,24 +404,20 @@ class CultAdvancedViewSet(viewsets.ReadOnlyModelViewSet):
         agent = options.get('agent')
         range = options.get('range')
         med_diocese = options.get('med_diocese')
-        queryset = models.Cult.objects.select_related("place", "cult_type").prefetch_related("relation_other_place").all()
+        queryset = models.Cult.objects.select_related("place", "cult_type").prefetch_related("relation_other_place", "relationcultagent_set__agent").all()
         # queryset = queryset.prefetch_related("place__parish__medival_organization").prefetch_related("place__place_type").prefetch_related("cult_children").prefetch_related("quote").prefetch_related("associated").prefetch_related("relationotheragent_set")
         if cult_type is not None and cult_type != '':
             types = cult_type.split(',')
-            queryset = queryset.prefetch_related("cult_type__parent")
-            queryset = queryset.filter(Q(cult_type__in=types) | Q(cult_type__parent__in=types) | Q(cult_type__parent__parent__in=types))
+            queryset = queryset.filter(cult_type__lineage__overlap=types)
         if place_type is not None and place_type != '':
             place_types = place_type.split(',')
-            queryset = queryset.prefetch_related("place__place_type", "relation_other_place__place_type")
-            queryset = queryset.filter(Q(place__place_type__in=place_types) 
-                                       | Q(place__place_type__parent__in=place_types)
-                                       | Q(relation_other_place__place_type__in=place_types) 
-                                       | Q(relation_other_place__place_type__parent__in=place_types))
+            queryset = queryset.filter(Q(place__place_type__lineage__overlap=place_types)
+                                       | Q(relation_other_place__place_type__lineage__overlap=place_types))
         if med_diocese is not None and med_diocese != '':
             queryset = queryset.prefetch_related("place__parish__medival_organization", "relation_other_place__parish__medival_organization")
             queryset = queryset.filter(Q(place__parish__medival_organization_id=med_diocese) | Q(relation_other_place__parish__medival_organization_id=med_diocese))
         if agent_type is not None or agent is not None:
-            queryset = queryset.prefetch_related("relationcultagent_set__agent", "relationotheragent_set__agent")
+            queryset = queryset.prefetch_related("relationotheragent_set__agent")
             if agent is not None and agent != '':
                 agents = agent.split(',')
                 queryset = queryset.filter(Q(relation_cult_agent__in=agents) | Q(relationotheragent__agent__in=agents)).distinct()
@@ -217,12 +428,16 @@ class CultAdvancedViewSet(viewsets.ReadOnlyModelViewSet):
             years = range.split(',')
             minyear = int(years[0])
             maxyear = int(years[1])
-            queryset = queryset.filter(minyear__lte=maxyear, maxyear__gte=minyear)
+            queryset = queryset.filter(years__overlap=year_range(minyear, maxyear))
         return queryset.order_by('place__name')
 
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     pagination_class = LargeResultsSetPagination
     serializer_class = CultMiniSerializer
+
+    def get_serializer_class(self):
+        return CultMiniRowSerializer if self.action == 'list' else CultMiniSerializer
+
     search_fields = ['place__name', 'cult_type__name', 'relation_cult_agent__name']
     ordering_fields = ['place__name', 'cult_type__name']
     ordering = ['place__name']
@@ -238,11 +453,15 @@ class PlacesViewSet(OrderingMixin):
         queryset = models.Place.objects.filter(exclude=False).select_related("place_type", "created", "modified", "parish", "parent")
         queryset = queryset.prefetch_related("relation_cult_place__cult_type").order_by('name')
         options = self.request.query_params
+        if options.get('mini') is None:
+            queryset = queryset.prefetch_related("placename_set", "quote", "parish__medival_organization", "parent__parish__medival_organization", "parent__place_type")
+            queryset = queryset.prefetch_related("relation_cult_place__place", "relation_cult_place__relationcultagent_set__agent")
+            queryset = queryset.prefetch_related("relationotherplace_set__role", cult_mini_prefetch("relationotherplace_set__cult"))
         place_type = options.get('type')
         med_diocese = options.get('med_diocese')
         if place_type is not None:
             types = place_type.split(',')
-            queryset = queryset.filter(Q(place_type__in=types) | Q(place_type__parent__in=types)).order_by('name')
+            queryset = queryset.filter(place_type__lineage__overlap=types).order_by('name')
         if med_diocese is not None and med_diocese != '':
             queryset = queryset.filter(parish__medival_organization_id=med_diocese).order_by('name')
         return queryset
@@ -250,7 +469,7 @@ class PlacesViewSet(OrderingMixin):
     def get_serializer_class(self):
         mini = self.request.query_params.get('mini')
         if mini is not None:
-            return PlaceMiniSerializer
+            return PlaceMiniRowSerializer if self.action == 'list' else PlaceMiniSerializer
         else:
             return PlaceSerializer
 
@@ -260,8 +479,8 @@ class PlacesViewSet(OrderingMixin):
             return LargeResultsSetPagination
         return api_settings.DEFAULT_PAGINATION_CLASS
 
+    filter_backends = [DocumentSearchFilter, filters.OrderingFilter]
     pagination_class = property(fget=get_pagination_class)
-    search_fields = ['name', 'placename__name']
 
 
 class PlaceChildrenViewSet(OrderingMixin):
@@ -271,7 +490,8 @@ class PlaceChildrenViewSet(OrderingMixin):
         by filtering against a `type` query parameter in the URL.
         """
         # optimize for mini search
-        queryset = models.Place.objects.filter(exclude=False).select_related("parent", "parent__place_type").prefetch_related("relation_cult_place__cult_type", "place_type")
+        queryset = models.Place.objects.filter(exclude=False).select_related("parent__place_type__parent").prefetch_related("place_type")
+        queryset = queryset.prefetch_related(cult_mini_prefetch("relation_cult_place"), cult_mini_prefetch("relation_other_place"))
         id = self.request.query_params.get('id')
         if id is not None:
             queryset = queryset.filter(parent=id).order_by('name')
@@ -283,7 +503,7 @@ class PlaceChildrenViewSet(OrderingMixin):
     pagination_class = LargeResultsSetPagination
 
 
-class SourcesViewSet(viewsets.ReadOnlyModelViewSet):
+class SourcesViewSet(CachedResponseMixin, KeysetPaginationMixin, viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         """
         Optionally restrict the returned sources to a type
@@ -291,7 +511,7 @@ class SourcesViewSet(viewsets.ReadOnlyModelViewSet):
         and/or `letter` query parameter in the URL.
         """
         if self.detail is True and self.request.query_params.get('mini') is None:
-            queryset = models.Source.objects.prefetch_related("source_quote__cult_quote__place", "source_quote__cult_quote__cult_type", "source_quote__cult_quote")
+            queryset = models.Source.objects.prefetch_related(cult_mini_prefetch("source_quote__cult_quote"))
         # .prefetch_related(Prefetch(
         #   'source_quote__cult_quote',
         #     'agent')
@@ -324,7 +544,7 @@ class SourcesViewSet(viewsets.ReadOnlyModelViewSet):
     ordering = ['title']
 
 
-class QuotesViewSet(viewsets.ReadOnlyModelViewSet):
+class QuotesViewSet(CachedResponseMixin, KeysetPaginationMixin, RowSerializerMixin, viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         """
         Optionally restrict the returned quotes against a `source`
@@ -337,13 +557,13 @@ class QuotesViewSet(viewsets.ReadOnlyModelViewSet):
         if source is not None:
             queryset = queryset.filter(source=source)
         if mini is None:
-            queryset = queryset.prefetch_related('cult_quote__relation_cult_agent', 'cult_quote__place', 'cult_quote__cult_type')
+            queryset = queryset.prefetch_related(cult_mini_prefetch('cult_quote'))
         return queryset.order_by('source__name')
 
     def get_serializer_class(self):
         mini = self.request.query_params.get('mini')
         if mini is not None:
-            return QuoteMiniSerializer
+            return QuoteMiniRowSerializer if self.action == 'list' else QuoteMiniSerializer
         else:
             return QuoteSerializer
 
@@ -354,8 +574,7 @@ class QuotesViewSet(viewsets.ReadOnlyModelViewSet):
         return MediumResultsSetPagination
 
     pagination_class = property(fget=get_pagination_class)
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['quote_transcription', 'translation', 'comment']
+    filter_backends = [DocumentSearchFilter, filters.OrderingFilter]
     ordering_fields = ['source__name']
     ordering = ['source__name']
 
@@ -376,6 +595,10 @@ class PlaceTypesViewSet(OrderingMixin):
             queryset = queryset.filter(level=level).order_by('name')
         return queryset
     serializer_class = PlaceTypeSerializer
+
+    def get_serializer_class(self):
+        return PlaceTypeRowSerializer if self.action == 'list' else PlaceTypeSerializer
+
     pagination_class = LargeResultsSetPagination
     search_fields = ['name', 'name_sv', 'name_fi']
 
@@ -400,6 +623,10 @@ class CultTypesViewSet(OrderingMixin):
             queryset = queryset.filter(level=level)
         return queryset.order_by('name')
     serializer_class = CultTypeSerializer
+
+    def get_serializer_class(self):
+        return CultTypeRowSerializer if self.action == 'list' else CultTypeSerializer
+
     pagination_class = LargeResultsSetPagination
     search_fields = ['name', 'name_sv', 'name_fi']
 
@@ -421,11 +648,15 @@ class AgentTypesViewSet(OrderingMixin):
                 queryset = queryset.filter(agent__saint=saint).distinct()
         return queryset.order_by('name')
     serializer_class = AgentTypeSerializer
+
+    def get_serializer_class(self):
+        return AgentTypeRowSerializer if self.action == 'list' else AgentTypeSerializer
+
     pagination_class = LargeResultsSetPagination
     search_fields = ['name', 'name_sv', 'name_fi']
 
 
-class MapViewSet(viewsets.ReadOnlyModelViewSet):
+class MapViewSet(ColumnarMapMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         options = self.request.query_params
         layer = options.get('layer')
@@ -445,27 +676,28 @@ class MapViewSet(viewsets.ReadOnlyModelViewSet):
                 extant = options.get('extant')
                 med_diocese = options.get('med_diocese')
                 if search is not None:
-                    queryset = queryset.prefetch_related("relation_cult_place").filter(Q(name__icontains=search)
-                                                         | Q(relation_cult_place__cult_type__name__icontains=search)
-                                                         | Q(relation_cult_place__relation_cult_agent__name__icontains=search)
-                                                         | Q(relation_cult_place__relationotheragent__agent__name__icontains=search)).distinct()
+                    cults = models.Cult.objects.filter(search_document__icontains=search).values('place_id')
+                    queryset = queryset.filter(Q(name__icontains=search) | Q(id__in=cults))
+                # subqueries instead of joins keep one row per place
                 if uncertainty is not None:
-                    queryset = queryset.prefetch_related("relation_cult_place").filter(relation_cult_place__cult_uncertainty=uncertainty)
+                    uncertainty = uncertainty.lower() in ('true', '1')
+                    cults = models.Cult.objects.filter(cult_uncertainty=uncertainty).values('place_id')
+                    queryset = queryset.filter(id__in=cults)
                 if extant is not None:
-                    queryset = queryset.prefetch_related("relation_cult_place").filter(relation_cult_place__extant=extant)
+                    cults = models.Cult.objects.filter(extant=extant).values('place_id')
+                    queryset = queryset.filter(id__in=cults)
                 if med_diocese is not None and med_diocese != '':
                     queryset = queryset.select_related("parish").filter(parish__medival_organization_id=med_diocese)
                 if ids is not None and ids != 'null':
                     types = ids.split(',')
-                    queryset = queryset.prefetch_related("relation_cult_place").filter(Q(relation_cult_place__cult_type__in=types)
-                                               | Q(relation_cult_place__cult_type__parent__in=types)
-                                               | Q(relation_cult_place__cult_type__parent__parent__in=types)).distinct()
+                    summary = models.MapSummary.objects.filter(own=True, cult_types__overlap=types)
+                    queryset = queryset.filter(id__in=summary.values('place_id'))
             else:
                 gender = options.get('gender')
                 agents = options.get('agent')
                 operator = options.get('op')
                 if search is not None:
-                    agentset = models.Agent.objects.filter(Q(name__icontains=search) | Q(agentname__name__icontains=search)).distinct()
+                    agentset = models.Agent.objects.filter(search_document__icontains=search)
                 else:
                     agentset = models.Agent.objects.all()
                 if gender is not None and gender != '' and gender != 'all':
@@ -497,13 +729,13 @@ class MapViewSet(viewsets.ReadOnlyModelViewSet):
                 years = range.split(',')
                 minyear = int(years[0])
                 maxyear = int(years[1])
-                queryset = queryset.filter(relation_cult_place__minyear__lte=maxyear,
-                                           relation_cult_place__maxyear__gte=minyear)
+                summary = models.MapSummary.objects.filter(own=True, years__overlap=year_range(minyear, maxyear))
+                queryset = queryset.filter(id__in=summary.values('place_id'))
 
         elif layer == 'place':
             med_diocese = options.get('med_diocese')
             if search is not None:
-                queryset = queryset.filter(Q(name__icontains=search) | Q(placename__name__icontains=search)).distinct()
+                queryset = queryset.filter(search_document__icontains=search)
             if zoom is not None and zoom != 'null' and zoom < 13 and ids is None:
                 if zoom < 9:
                     queryset = queryset.filter(place_type__parent__in=[1,2])
@@ -516,7 +748,7 @@ class MapViewSet(viewsets.ReadOnlyModelViewSet):
                 queryset = queryset.exclude(place_type__in=[30,58,61])
             if ids is not None and ids != 'null':
                 types = ids.split(',')
-                queryset = queryset.filter(Q(place_type__in=types) | Q(place_type__parent__in=types)).order_by('name')
+                queryset = queryset.filter(place_type__lineage__overlap=types).order_by('name')
             if med_diocese is not None and med_diocese != '':
                 queryset = queryset.select_related("parish").filter(parish__medival_organization_id=med_diocese)
 
@@ -542,43 +774,59 @@ class MapViewSet(viewsets.ReadOnlyModelViewSet):
         else:
             return PeopleMapSerializer
 
+    @action(detail=False)
+    def clusters(self, request):
+        return self.cached_response(self.get_clusters, request)
+
+    def get_clusters(self, request):
+        """
+        Group the places of a layer into grid cells sized by the `zoom`
+        query parameter and return one point feature per cell.
+        """
+        zoom = request.query_params.get('zoom')
+        if zoom is not None and zoom.isnumeric():
+            zoom = int(zoom)
+        else:
+            zoom = 0
+        size = 360 / 2 ** zoom / CLUSTER_GRID_SIZE
+        places = self.filter_queryset(self.get_queryset())
+        cells = models.Place.objects.filter(id__in=places.values('id'))
+        cells = cells.annotate(cell=SnapToGrid('geometry', size)).values('cell').annotate(
+            count=Count('id'), place=Min('id'), center=Centroid(Collect('geometry'))).order_by()
+        features = []
+        for cell in cells:
+            features.append({
+                'type': 'Feature',
+                'geometry': json.loads(cell['center'].geojson),
+                'properties': {
+                    'count': cell['count'],
+                    # single places can be opened directly
+                    'id': cell['place'] if cell['count'] == 1 else None,
+                },
+            })
+        return Response({'type': 'FeatureCollection', 'features': features})
+
     filter_backends = [InBBoxFilter, filters.SearchFilter]
     bbox_filter_field = 'geometry'
     pagination_class = LargeResultsSetPagination
 
 
-class AdvancedMapViewSet(viewsets.ReadOnlyModelViewSet):
-    def get_queryset(self):
+class AdvancedMapViewSet(ColumnarMapMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    def get_cult_queryset(self):
+        """
+        Restrict the cults shown on the map by the `type`, `agent_type`,
+        `agent` and `range` query parameters.
+        """
         options = self.request.query_params
-        zoom = options.get('zoom')
-        if zoom is not None and zoom.isnumeric():
-            zoom = int(zoom)
-        bbox = options.get('bbox')
         range = options.get('range')
         cult_type = options.get('type')
-        place_type = options.get('place_type')
         agent_type = options.get('agent_type')
         agent = options.get('agent')
-        med_diocese = options.get('med_diocese')
 
         queryset = models.Cult.objects.all()
-        place_set = models.Place.objects.prefetch_related("place_type").filter(exclude=False)
         if cult_type is not None and cult_type != '':
             types = cult_type.split(',')
-            levels = models.CultType.objects.filter(id__in=types).values("level").distinct()
-            if len(levels) == 1:
-                level = levels[0]["level"]
-                if level == "Subcategory":
-                    queryset = queryset.prefetch_related("cult_type").filter(cult_type__in=types)
-                elif level == "Intermediate":
-                    queryset = queryset.prefetch_related("cult_type__parent").filter(cult_type__parent__in=types)
-                else:
-                    queryset = queryset.prefetch_related("cult_type__parent__parent").filter(cult_type__parent__parent__in=types)
-            else:
-                queryset = queryset.prefetch_related("cult_type", "cult_type__parent",
-                                                     "cult_type__parent__parent").filter(Q(cult_type__in=types)
-                                                                                         | Q(cult_type__parent__in=types)
-                                                                                         | Q(cult_type__parent__parent__in=types)).distinct()
+            queryset = queryset.filter(cult_type__lineage__overlap=types)
 
         if agent_type is not None and agent_type != '':
             agent_types = agent_type.split(',')
@@ -595,7 +843,21 @@ class AdvancedMapViewSet(viewsets.ReadOnlyModelViewSet):
             years = range.split(',')
             minyear = int(years[0])
             maxyear = int(years[1])
-            queryset = queryset.filter(minyear__lte=maxyear, maxyear__gte=minyear)
+            queryset = queryset.filter(years__overlap=year_range(minyear, maxyear))
+
+        return queryset
+
+    def get_queryset(self):
+        options = self.request.query_params
+        zoom = options.get('zoom')
+        if zoom is not None and zoom.isnumeric():
+            zoom = int(zoom)
+        bbox = options.get('bbox')
+        place_type = options.get('place_type')
+        med_diocese = options.get('med_diocese')
+
+        queryset = self.get_cult_queryset()
+        place_set = models.Place.objects.prefetch_related("place_type").filter(exclude=False)
 
         if bbox is not None:
             bbox = bbox.strip().split(',')
@@ -608,17 +870,57 @@ class AdvancedMapViewSet(viewsets.ReadOnlyModelViewSet):
 
         if place_type is not None and place_type != '':
             place_types = place_type.split(',')
-            place_set = place_set.prefetch_related("place_type__parent").filter(Q(place_type__in=place_types)
-                                       | Q(place_type__parent__in=place_types)).order_by('name')
+            place_set = place_set.filter(place_type__lineage__overlap=place_types).order_by('name')
 
         if med_diocese is not None and med_diocese != '':
             place_set = place_set.select_related("parish").filter(parish__medival_organization_id=med_diocese)
 
-        place_set = place_set.filter(Q(relation_cult_place__in=queryset)
-                                     | Q(relation_other_place__in=queryset)).distinct()
+        summary = models.MapSummary.objects.filter(cult__in=queryset.values('id'))
+        place_set = place_set.filter(id__in=summary.values('place_id'))
         return place_set.order_by('name')
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['cults'] = self.get_cult_queryset()
+        return context
+
     filter_backends = [InBBoxFilter, filters.SearchFilter]
     serializer_class = AdvancedCultMapSerializer
     bbox_filter_field = 'geometry'
     pagination_class = LargeResultsSetPagination
+
+
+class ExportViewSet(viewsets.ViewSet):
+    """
+    Stream all places with their cults and agents as a GeoJSON feature
+    collection, or with `output=ndjson` as one GeoJSON feature per line.
+    Cults without a place follow as features without geometry, places
+    excluded from the map are left out with their cults.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def list(self, request):
+        output = request.query_params.get('output')
+        if output not in FORMATS:
+            output = 'geojson'
+        content_type = 'application/x-ndjson' if output == 'ndjson' else 'application/geo+json'
+        response = StreamingHttpResponse(export(output), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="saints.%s"' % output
+        return response
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """
+    Query counts, timings and response sizes of the sampled requests served
+    by this worker process, per route and serializer, and the state of its
+    database connection pools.
+    """
+    permission_classes = [IsInternal]
+
+    def list(self, request):
+        return Response({
+            'pid': os.getpid(),
+            'sample_rate': settings.METRICS_SAMPLE_RATE,
+            'routes': get_stats(),
+            'pools': get_pool_stats(),
+        })
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.gis',
+    'django.contrib.postgres',
     'wagtail.contrib.forms',
     'wagtail.contrib.redirects',
     'wagtail.contrib.settings',
@@ -70,7 +71,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'wagtail.contrib.redirects.middleware.RedirectMiddleware'
+    'wagtail.contrib.redirects.middleware.RedirectMiddleware',
+    'explore.instrumentation.MetricsMiddleware',
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -144,9 +146,38 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 25
+    'PAGE_SIZE': 25,
+    # orjson by default, the standard library encoder with ?format=json
+    'DEFAULT_RENDERER_CLASSES': [
+        'explore.renderers.ORJSONRenderer',
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# The explore API caches its responses until the data is changed. Use a
+# backend shared by all workers in production, e.g. file based or Redis.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
 }
 
+EXPLORE_CACHE_TIMEOUT = int(os.getenv('EXPLORE_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# K-samsök records shown with cults, SAMSOEK_URL can point to a stub server
+SAMSOEK_URL = os.getenv('SAMSOEK_URL')
+SAMSOEK_TIMEOUT = 10
+SAMSOEK_TTL = 60 * 60 * 24
+SAMSOEK_STALE_TTL = 60 * 60 * 24 * 30
+SAMSOEK_ERROR_TTL = 60 * 5
+SAMSOEK_WORKERS = 8
+
+# Share of requests whose query count, timings and size are logged to the
+# explore.metrics logger and shown at /api/metrics/
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 0.05))
+
 LEAFLET_CONFIG = {
     'DEFAULT_CENTER': (6.0, 45.0),
     'DEFAULT_ZOOM': 16,
@@ -57,6 +57,40 @@ DATABASES = {
     }
 }
 
+# Each gunicorn worker process keeps a pool of DB_POOL_MIN_SIZE to
+# DB_POOL_MAX_SIZE connections, so the pools of all workers together must fit
+# in max_connections of the database. Without the pool, connections are kept
+# open for CONN_MAX_AGE seconds instead.
+if os.getenv('DB_POOL', 'true').lower() in ('true', '1', 'yes'):
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 4)),
+            # seconds a request waits for a free connection
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            # seconds before idle connections above min_size are closed
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 600)),
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+    }
+}
+
+# The file based cache deletes a random third of its entries once it holds
+# MAX_ENTRIES, which would take the data version and K-samsök records with
+# it, so the limit is kept well above the number of entries in use.
+if CACHES['default']['BACKEND'].endswith('FileBasedCache'):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100000)),
+    }
+
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 5000
 
 # wagtail settings